@@ -0,0 +1,41 @@
+import json
+import sys
+
+# Compara dos resultados de bench/run.py: python bench/compare.py antes.json despues.json
+# Solo se muestran los valores numéricos medidos (no los parámetros).
+
+SKIP = {"params", "library", "timestamp", "commit", "python", "platform", "cpus"}
+
+
+def flatten(data, prefix=""):
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from flatten(value, name + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.exit("Uso: python bench/compare.py antes.json despues.json")
+    with open(sys.argv[1]) as f:
+        before = json.load(f)
+    with open(sys.argv[2]) as f:
+        after = json.load(f)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    if before.get("params") != after.get("params"):
+        print("Aviso: los parámetros de las dos ejecuciones no coinciden")
+    old = dict(flatten({k: v for k, v in before.items() if k not in SKIP}))
+    new = dict(flatten({k: v for k, v in after.items() if k not in SKIP}))
+    width = max(map(len, new), default=0)
+    for name, value in new.items():
+        if name not in old:
+            print(f"{name:<{width}}  {'':>12}  {value:>12}")
+            continue
+        change = f"{(value - old[name]) / old[name] * 100:+.1f}%" if old[name] else ""
+        print(f"{name:<{width}}  {old[name]:>12}  {value:>12}  {change}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import random
+import struct
+
+# Generador de bibliotecas sintéticas de FLAC reales (pequeños: el audio es una señal
+# constante, que FLAC codifica en 3 bytes por canal y frame) con etiquetas y portadas.
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+BITS_PER_SAMPLE = 16
+BLOCK_SIZE = 4096
+STREAMINFO, VORBIS_COMMENT, PICTURE = 0, 4, 6
+FRONT_COVER = 3
+WORDS = (
+    "amor noche luz sol mar cielo fuego sombra tiempo camino sueño ciudad viento lluvia "
+    "corazón silencio memoria espejo río luna estrella invierno verano azul rojo negro "
+    "blue night light love heart dream fire shadow river moon star summer winter city "
+    "road rain silence mirror memory gold black red wild free lost home ghost echo"
+).split()
+
+
+def crc8(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+
+def crc16(data):
+    crc = 0
+    for byte in data:
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x8005) & 0xFFFF if crc & 0x8000 else (crc << 1) & 0xFFFF
+    return crc
+
+
+def utf8_number(n):
+    # Número de frame codificado como en UTF-8 (extendido hasta 36 bits)
+    if n < 0x80:
+        return bytes([n])
+    length = 2
+    while n >= 1 << (5 * length + 1):
+        length += 1
+    out = []
+    for _ in range(length - 1):
+        out.append(0x80 | (n & 0x3F))
+        n >>= 6
+    first = (0xFF << (8 - length)) & 0xFF | n
+    return bytes([first] + out[::-1])
+
+
+def metadata_block(kind, data, last=False):
+    return struct.pack(">I", (0x80000000 if last else 0) | kind << 24 | len(data)) + data
+
+
+def streaminfo(total_samples, md5):
+    packed = SAMPLE_RATE << 44 | (CHANNELS - 1) << 41 | (BITS_PER_SAMPLE - 1) << 36 | total_samples
+    return struct.pack(">HH", BLOCK_SIZE, BLOCK_SIZE) + b"\0" * 6 + struct.pack(">Q", packed) + md5
+
+
+def vorbis_comment(tags):
+    vendor = b"bench flacgen"
+    data = struct.pack("<I", len(vendor)) + vendor + struct.pack("<I", len(tags))
+    for key, value in tags.items():
+        entry = f"{key}={value}".encode()
+        data += struct.pack("<I", len(entry)) + entry
+    return data
+
+
+def picture(image, mime="image/jpeg", width=8, height=8):
+    mime = mime.encode()
+    return (struct.pack(">II", FRONT_COVER, len(mime)) + mime + struct.pack(">I", 0)
+            + struct.pack(">IIIII", width, height, 24, 0, len(image)) + image)
+
+
+def frame(number, block_size, value):
+    # Frame con subframes CONSTANT: todas las muestras valen `value`
+    if block_size == BLOCK_SIZE:
+        size_code, size_extra = 0xC, b""  # 4096 = 256 * 2^4
+    else:
+        size_code, size_extra = 0x7, struct.pack(">H", block_size - 1)
+    header = bytes([0xFF, 0xF8, size_code << 4 | 0x9, (CHANNELS - 1) << 4 | 0x4 << 1])  # 44,1 kHz, 16 bits
+    header += utf8_number(number) + size_extra
+    header += bytes([crc8(header)])
+    body = header + (b"\x00" + struct.pack(">h", value)) * CHANNELS
+    return body + struct.pack(">H", crc16(body))
+
+
+def audio_md5(total_samples, value):
+    # MD5 de las muestras decodificadas (little-endian, canales intercalados), como STREAMINFO
+    md5 = hashlib.md5()
+    chunk = struct.pack("<h", value) * CHANNELS * BLOCK_SIZE
+    remaining = total_samples
+    while remaining:
+        n = min(remaining, BLOCK_SIZE)
+        md5.update(chunk if n == BLOCK_SIZE else chunk[:n * CHANNELS * 2])
+        remaining -= n
+    return md5.digest()
+
+
+def write_flac(path, tags, seconds=2.0, value=0, cover=None):
+    total_samples = int(seconds * SAMPLE_RATE)
+    blocks = [(STREAMINFO, streaminfo(total_samples, audio_md5(total_samples, value))),
+              (VORBIS_COMMENT, vorbis_comment(tags))]
+    if cover:
+        blocks.append((PICTURE, picture(cover)))
+    data = b"fLaC" + b"".join(metadata_block(kind, block, last=i == len(blocks) - 1)
+                              for i, (kind, block) in enumerate(blocks))
+    frames = []
+    for number, start in enumerate(range(0, total_samples, BLOCK_SIZE)):
+        frames.append(frame(number, min(BLOCK_SIZE, total_samples - start), value))
+    with open(path, "wb") as f:
+        f.write(data + b"".join(frames))
+
+
+def segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack(">H", len(payload) + 2) + payload
+
+
+def make_jpeg(gray=0, padding=0):
+    # JPEG baseline de 8x8 píxeles en escala de grises, de un solo color. Las tablas de
+    # Huffman tienen un único código ("0"): DC de categoría 0 y fin de bloque.
+    # `padding` añade comentarios para simular escaneos de portada grandes.
+    data = b"\xFF\xD8"
+    data += segment(0xFE, f"bench cover {gray}".encode())
+    while padding > 0:
+        chunk = min(padding, 65000)
+        data += segment(0xFE, b"\0" * chunk)
+        padding -= chunk
+    data += segment(0xDB, b"\x00" + b"\x01" * 64)  # Tabla de cuantización 0, todo unos
+    data += segment(0xC0, bytes([8, 0, 8, 0, 8, 1, 1, 0x11, 0]))  # 8x8, 1 componente
+    data += segment(0xC4, b"\x00" + bytes([1] + [0] * 15) + b"\x00")  # DC: categoría 0
+    data += segment(0xC4, b"\x10" + bytes([1] + [0] * 15) + b"\x00")  # AC: fin de bloque
+    data += segment(0xDA, bytes([1, 1, 0x00, 0, 63, 0]))
+    return data + b"\x3F" + b"\xFF\xD9"  # bits "00" (DC 0, EOB) rellenados con unos
+
+
+def title(rng, words=(1, 5)):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(*words))).title()
+
+
+def generate_library(root, artists=10, albums=3, tracks=10, seconds=2.0, cover_kb=0, embedded=0.5, seed=0):
+    # Crea root/<artista>/<álbum>/<nn - título>.flac. Una parte de los álbumes lleva la
+    # portada como cover.jpg en la carpeta y el resto incrustada en cada FLAC.
+    # Devuelve (número de archivos, bytes escritos).
+    rng = random.Random(seed)
+    files = size = 0
+    for a in range(artists):
+        artist = f"{title(rng, (1, 3))} {a}"
+        for b in range(albums):
+            album = title(rng, (1, 4))
+            year = rng.randint(1960, 2024)
+            folder = os.path.join(root, artist, f"{year} - {album}")
+            os.makedirs(folder, exist_ok=True)
+            cover = make_jpeg(rng.randrange(256), cover_kb * 1024)
+            embed = rng.random() < embedded
+            if not embed:
+                with open(os.path.join(folder, "cover.jpg"), "wb") as f:
+                    f.write(cover)
+            for t in range(1, tracks + 1):
+                song = title(rng)
+                path = os.path.join(folder, f"{t:02} - {song}.flac")
+                tags = {"TITLE": song, "ARTIST": artist, "ALBUM": album, "DATE": year, "TRACKNUMBER": t}
+                # Un valor distinto por pista para que cada una tenga su propio MD5 de audio
+                write_flac(path, tags, seconds, value=(files % 60000) - 30000, cover=cover if embed else None)
+                files += 1
+                size += os.path.getsize(path)
+    return files, size
@@ -0,0 +1,207 @@
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# Benchmarks sin Discord ni red: genera una biblioteca sintética de FLAC y mide el escaneo,
+# la carga de la base de datos y la latencia de búsqueda, ranking y autocompletado.
+#
+#   python bench/run.py --artists 200 --albums 5 --tracks 12
+#   python bench/compare.py bench/results/antes.json bench/results/despues.json
+
+BENCH_FOLDER = os.path.dirname(os.path.abspath(__file__))
+REPO_FOLDER = os.path.dirname(BENCH_FOLDER)
+sys.path.insert(0, os.path.join(REPO_FOLDER, "src"))
+
+from flacgen import generate_library  # noqa: E402
+from library.prefix import PrefixIndex  # noqa: E402
+from library.ranking import rank_by_similarity  # noqa: E402
+from library.scanner import scan_library  # noqa: E402
+from library.storage import SEARCH_FIELDS, open_store  # noqa: E402
+
+RESULTS_FOLDER = os.path.join(BENCH_FOLDER, "results")
+
+
+def rss_bytes():
+    # RSS actual (Linux); en otros sistemas, el máximo que da getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def percentiles(samples):
+    # Latencias en milisegundos
+    samples = sorted(samples)
+    if not samples:
+        return {}
+
+    def pick(p):
+        return round(samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000, 4)
+
+    return {"n": len(samples), "p50_ms": pick(50), "p90_ms": pick(90), "p99_ms": pick(99),
+            "max_ms": round(samples[-1] * 1000, 4), "mean_ms": round(sum(samples) / len(samples) * 1000, 4)}
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def make_queries(songs, count, rng):
+    # Subcadenas reales de cada campo (de 2 a 10 caracteres) y algunas que no existen
+    queries = []
+    for _ in range(count):
+        if rng.random() < 0.1:
+            queries.append("".join(rng.choice("qxzjkw") for _ in range(rng.randint(3, 8))))
+            continue
+        value = rng.choice(songs)[rng.choice(SEARCH_FIELDS)]
+        length = min(len(value), rng.randint(2, 10))
+        start = rng.randint(0, len(value) - length)
+        queries.append(value[start:start + length])
+    return queries
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_FOLDER,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_scan(library, backend, workers):
+    results = {}
+    start = time.perf_counter()
+    stats = asyncio.run(scan_library(library, full=True, workers=workers, backend=backend))
+    elapsed = time.perf_counter() - start
+    results["full"] = {"seconds": round(elapsed, 4), "files": stats["total"],
+                       "files_per_second": round(stats["total"] / elapsed, 1) if elapsed else None}
+    # Segundo escaneo sin cambios: solo recorre el disco y compara con el manifiesto
+    start = time.perf_counter()
+    asyncio.run(scan_library(library, workers=workers, backend=backend))
+    results["incremental_noop"] = {"seconds": round(time.perf_counter() - start, 4)}
+    return results
+
+
+def bench_queries(store, songs, queries, repeat):
+    search = {}
+    for field in SEARCH_FIELDS:
+        samples = []
+        for _ in range(repeat):
+            for query in queries:
+                samples.append(timed(store.search, field, query)[1])
+        search[field] = percentiles(samples)
+
+    samples = []
+    for query in queries:
+        candidates = store.search("title", query)
+        samples.append(timed(rank_by_similarity, candidates, query)[1])
+    ranking = percentiles(samples)
+    # Peor caso del ranking: comparar la consulta con toda la biblioteca
+    full_scan = percentiles([timed(rank_by_similarity, songs, query)[1] for query in queries[:20]])
+
+    suggestions, build = timed(PrefixIndex, songs)
+    samples = []
+    for query in queries:
+        # Como al escribir: cada prefijo de la consulta
+        for end in range(1, len(query) + 1):
+            samples.append(timed(suggestions.suggest, query[:end])[1])
+    autocomplete = percentiles(samples)
+    autocomplete["build_seconds"] = round(build, 4)
+    autocomplete["keys"] = len(suggestions)
+    return {"search": search, "ranking": ranking, "ranking_full_library": full_scan, "autocomplete": autocomplete}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del escaneo, la base de datos y las búsquedas")
+    parser.add_argument("--artists", type=int, default=50)
+    parser.add_argument("--albums", type=int, default=4, help="Álbumes por artista")
+    parser.add_argument("--tracks", type=int, default=10, help="Canciones por álbum")
+    parser.add_argument("--seconds", type=float, default=2.0, help="Duración de cada canción")
+    parser.add_argument("--cover-kb", type=int, default=64, help="Tamaño de cada portada")
+    parser.add_argument("--embedded", type=float, default=0.5, help="Fracción de álbumes con la portada incrustada")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones de cada búsqueda")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--library", help="Usar (o crear) la biblioteca en esta carpeta en lugar de una temporal")
+    parser.add_argument("--output", help="Archivo JSON de resultados (por defecto en bench/results/)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="hiresqueen-bench-")
+    library = args.library or os.path.join(workdir, "music")
+    try:
+        generated = None
+        if not args.library or not os.path.isdir(library):
+            print(f"Generando biblioteca en {library}...")
+            (files, size), elapsed = timed(generate_library, library, args.artists, args.albums, args.tracks,
+                                           args.seconds, args.cover_kb, args.embedded, args.seed)
+            generated = {"files": files, "bytes": size, "seconds": round(elapsed, 2)}
+        library = os.path.abspath(library)
+
+        # El escáner y las bases de datos escriben en ./data
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            print("Escaneando...")
+            scan = bench_scan(library, args.backend, args.workers)
+
+            print("Cargando la base de datos...")
+            gc.collect()
+            before = rss_bytes()
+            store, load_seconds = timed(lambda: open_store(args.backend).load())
+            gc.collect()
+            load = {"seconds": round(load_seconds, 4), "songs": store.count(),
+                    "rss_delta_bytes": rss_bytes() - before, "rss_bytes": rss_bytes()}
+
+            print("Midiendo búsquedas...")
+            songs = store.all_songs()
+            queries = make_queries(songs, args.queries, random.Random(args.seed))
+            queries_results = bench_queries(store, songs, queries, args.repeat)
+            store.close()
+        finally:
+            os.chdir(cwd)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": vars(args),
+        "library": generated,
+        "scan": scan,
+        "load": load,
+        **queries_results,
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+    }
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_FOLDER, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_FOLDER, f"{stamp}-{report['commit'] or 'local'}-{args.backend}.json")
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({key: report[key] for key in ("scan", "load", "search", "ranking", "autocomplete")}, indent=2))
+    print(f"Resultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()
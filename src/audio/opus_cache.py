@@ -0,0 +1,109 @@
+import asyncio
+import hashlib
+import os
+from audio.scheduler import BACKGROUND
+from logs import get_logger
+
+log = get_logger(__name__)
+
+CACHE_FOLDER = os.path.join("data", "opus_cache")
+
+
+def cache_key(song_data, bitrate, gain=None):
+    # El MD5 del audio (STREAMINFO) no cambia al editar etiquetas; si el archivo no lo
+    # tiene se usa la ruta junto con el tamaño y la fecha de modificación
+    digest = song_data.get("audio_md5")
+    if not digest:
+        stat = os.stat(song_data["filepath"])
+        signature = f"{song_data['filepath']}:{stat.st_size}:{stat.st_mtime_ns}"
+        digest = hashlib.sha1(signature.encode()).hexdigest()
+    # La ganancia de normalización va incluida en la copia
+    return f"{digest}-{bitrate}k" + (f"{gain:+.2f}dB" if gain else "")
+
+
+class OpusCache:
+    # Copias en Ogg/Opus de las canciones, ya codificadas al bitrate de Discord. Con ellas
+    # FFmpeg solo reempaqueta los paquetes (codec copy) y el bot no decodifica ni codifica nada.
+    # El tamaño total está acotado: se borran primero las que hace más tiempo que no suenan.
+    def __init__(self, max_bytes, scheduler, bitrate=96, workers=1, normalize=True, folder=CACHE_FOLDER):
+        self.max_bytes = max_bytes
+        self.normalize = normalize
+        self.scheduler = scheduler  # Las codificaciones ceden los procesos de FFmpeg a la reproducción
+        self.bitrate = bitrate
+        self.folder = folder
+        self.pending = asyncio.Queue()
+        self.queued = set()
+        self.workers = [asyncio.create_task(self.worker()) for _ in range(workers)]
+        os.makedirs(folder, exist_ok=True)
+
+    def gain(self, song_data):
+        return song_data.get("gain") if self.normalize else None
+
+    def key(self, song_data):
+        return cache_key(song_data, self.bitrate, self.gain(song_data))
+
+    def path(self, key):
+        return os.path.join(self.folder, f"{key}.ogg")
+
+    def lookup(self, song_data):
+        # Devuelve la copia en caché o None. Usarla actualiza su fecha para el LRU
+        try:
+            path = self.path(self.key(song_data))
+            os.utime(path)
+            return path
+        except OSError:
+            return None
+
+    def enqueue(self, song_data):
+        # Codifica la canción en segundo plano para la próxima vez que suene
+        key = self.key(song_data)
+        if key not in self.queued and not os.path.exists(self.path(key)):
+            self.queued.add(key)
+            self.pending.put_nowait((key, song_data))
+
+    async def worker(self):
+        while True:
+            key, song_data = await self.pending.get()
+            try:
+                # Sin límite de espera: en segundo plano da igual tardar
+                async with await self.scheduler.acquire(BACKGROUND, timeout=float("inf")):
+                    await self.transcode(key, song_data)
+                await asyncio.to_thread(self.evict)
+            except Exception as e:
+                log.warning("error al codificar en Opus", path=song_data["filepath"], error=e)
+            finally:
+                self.queued.discard(key)
+
+    async def transcode(self, key, song_data):
+        tmp_path = f"{self.path(key)}.{os.getpid()}.tmp"  # Varios procesos de audio comparten la caché
+        gain = self.gain(song_data)
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", song_data["filepath"],
+            *(["-af", f"volume={gain:.2f}dB"] if gain else []),
+            # Discord espera paquetes de 20 ms a 48 kHz en estéreo
+            "-vn", "-map_metadata", "-1", "-c:a", "libopus", "-b:a", f"{self.bitrate}k", "-frame_duration", "20",
+            "-ar", "48000", "-ac", "2", "-f", "ogg", tmp_path,
+            stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(stderr.decode(errors="replace").strip())
+        os.replace(tmp_path, self.path(key))
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.folder):
+            if entry.name.endswith(".ogg"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def close(self):
+        for task in self.workers:
+            task.cancel()
@@ -0,0 +1,393 @@
+import asyncio
+import math
+import os
+import threading
+import time
+import discord
+from audio.queue import TrackQueue
+from audio.scheduler import LIVE, AdmissionTimeout
+from audio.sources import GaplessSource, PrefetchedSource
+from logs import get_logger
+
+log = get_logger(__name__)
+
+IDLE_TIMEOUT = 180  # Segundos sin reproducir antes de desconectarse
+DEFAULT_VOLUME = 100  # Porcentaje
+MAX_VOLUME = 200
+BUSY_MESSAGE = "El bot está reproduciendo en demasiados servidores a la vez. Inténtalo de nuevo en un momento."
+
+
+def volume_options(gain_db, boost=False):
+    # La ganancia de la pista y el volumen del usuario se aplican dentro de FFmpeg: el bot
+    # no toca los frames en Python (PCMVolumeTransformer escalaría cada frame)
+    if gain_db == -math.inf:
+        return "-af volume=0"
+    if not gain_db:
+        return None
+    chain = f"volume={gain_db:.2f}dB"
+    if boost:
+        # Por encima del 100 % se limita el pico para no saturar
+        chain += ",alimiter=limit=0.98:level=0"
+    return f"-af {chain}"
+
+
+def now_playing_embed(song_data, thumbnail_url=None):
+    # Crear el mensaje embed
+    embed = discord.Embed(
+        title="Reproduciendo",
+        description=f"**{song_data['artist']}** - **{song_data['title']}**",
+        color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
+    )
+
+    # Agregar la miniatura al mensaje embed (adjunta o ya subida a Discord)
+    if thumbnail_url:
+        embed.set_thumbnail(url=thumbnail_url)
+
+    # Agregar el álbum al mensaje embed si está disponible
+    if "album" in song_data:
+        embed.add_field(name="álbum", value=song_data["album"], inline=True)
+
+    # Agregar el año al mensaje embed si está disponible
+    if "year" in song_data:
+        embed.add_field(name="Año", value=song_data["year"], inline=True)
+
+    if "duration" in song_data:
+        embed.add_field(name="Duración", value=song_data["duration"], inline=True)
+
+    if "bitrate" in song_data:
+        embed.add_field(name="Bitrate", value=str(song_data["bitrate"]) + " kb/s", inline=True)
+
+    return embed
+
+
+class GuildPlayer:
+    # Estado de reproducción de un servidor: su cola, la canción actual y su temporizador de inactividad
+    def __init__(self, bot, guild, registry):
+        self.bot = bot
+        self.guild = guild
+        self.registry = registry
+        self.song_queue = TrackQueue()  # ids de canciones, se resuelven al reproducirse
+        self.now_playing = None
+        self.channel = None  # Canal de texto donde se anuncian las canciones
+        self.disconnect_timer = None  # Temporizador de desconexión
+        self.prefetched = None  # (fuente, canción) de la siguiente canción ya preparada
+        self.prefetch_lock = threading.Lock()
+        self.prefetching = False  # Esperando permiso para lanzar FFmpeg de la siguiente
+        self.start_lock = asyncio.Lock()  # Solo un play_song() arrancando la reproducción a la vez
+        self.generation = 0  # Cambia al detener la reproducción, invalida preparaciones en curso
+        self.volume = DEFAULT_VOLUME
+        self.finished_at = None  # Fin de la última canción cuando no hubo cambio sin pausa
+
+    @property
+    def voice_client(self):
+        return self.guild.voice_client
+
+    def is_active(self):
+        return self.voice_client is not None and (self.voice_client.is_playing() or self.voice_client.is_paused())
+
+    async def play_song(self):
+        try:
+            async with self.start_lock:
+                # Dos !play casi a la vez en un servidor sin música: el segundo encuentra sonando
+                # la canción que arrancó el primero y sus canciones ya quedaron en la cola
+                if self.is_active():
+                    return
+                # Si la siguiente canción ya se preparó (p. ej. al saltar cerca del final) se usa esa
+                prefetched = self.take_prefetched()
+                if prefetched:
+                    audio_source, song_data = prefetched
+                else:
+                    song_data = await self.next_song()
+                    if song_data is None:
+                        self.now_playing = None
+                        return
+                    try:
+                        audio_source = await self.open_source(song_data)
+                    except AdmissionTimeout:
+                        # La canción no se pierde: sonará con el próximo !play o /play
+                        self.song_queue.push_front(song_data["id"])
+                        raise
+
+                # Cancela el temporizador de desconexión
+                self.cancel_disconnect_timer()
+
+                # Reproducir el audio. El mensaje se envía después para no retrasar el inicio
+                source = GaplessSource(self, audio_source, song_data, gap_started=self.finished_at)
+                try:
+                    self.voice_client.play(source, after=lambda e: self.bot.loop.call_soon_threadsafe(self.song_finished))
+                except Exception:
+                    # La canción vuelve al principio de la cola para no perderla
+                    source.cleanup()
+                    self.song_queue.push_front(song_data["id"])
+                    raise
+                self.finished_at = None
+            await self.announce(song_data)
+
+        except AdmissionTimeout as e:
+            log.warning("sin procesos de FFmpeg libres", guild=self.guild.id, error=e)
+            self.arm_idle_timer()
+            await self.channel.send(BUSY_MESSAGE)
+        except Exception as e:
+            log.error("error al reproducir la canción", guild=self.guild.id, error=e)
+            self.arm_idle_timer()
+            await self.channel.send("Ocurrió un error al reproducir la canción.")
+
+    def arm_idle_timer(self):
+        # Si no quedó nada sonando tras un error, el bot se desconecta por inactividad
+        if not self.is_active():
+            self.now_playing = None
+            self.reset_disconnect_timer()
+
+    def gain_db(self, song_data):
+        # Normalización de la pista (medida al generar la base de datos) + volumen del usuario
+        gain = (song_data.get("gain") or 0.0) if self.registry.normalize else 0.0
+        if self.volume == 0:
+            return -math.inf
+        return gain + 20 * math.log10(self.volume / 100)
+
+    async def open_source(self, song_data, position=0):
+        filepath = song_data["filepath"]
+        log.debug("abriendo canción", guild=self.guild.id, path=filepath, position=position)
+        # Cada proceso de FFmpeg necesita un permiso del planificador global
+        slot = await self.registry.scheduler.acquire(LIVE, owner=self.guild.id)
+        try:
+            started = time.perf_counter()
+            before_options = f"-ss {position:.2f}" if position else None
+            # FFmpeg entrega paquetes Opus: el bot no decodifica a PCM ni codifica en Python
+            opus_cache = self.registry.opus_cache
+            # La copia en caché ya lleva aplicada la normalización; solo sirve con el volumen al 100 %
+            cached = opus_cache.lookup(song_data) if opus_cache and self.volume == DEFAULT_VOLUME else None
+            if cached:
+                # Copia ya codificada: FFmpeg solo reempaqueta los paquetes
+                source = discord.FFmpegOpusAudio(cached, codec="copy", before_options=before_options)
+            else:
+                source = discord.FFmpegOpusAudio(
+                    filepath, bitrate=self.registry.opus_bitrate, before_options=before_options,
+                    options=volume_options(self.gain_db(song_data), boost=self.volume > DEFAULT_VOLUME))
+                if opus_cache:
+                    opus_cache.enqueue(song_data)
+        except BaseException:
+            self.registry.scheduler.record_failure()
+            slot.release()
+            raise
+        source = PrefetchedSource(source, slot=slot, started=started)
+        slot.attach(source)
+        return source
+
+    async def set_volume(self, volume):
+        self.volume = volume
+        # La siguiente canción ya preparada se abrió con el volumen anterior: vuelve a la cola
+        prefetched = self.take_prefetched()
+        if prefetched:
+            prefetched[0].cleanup()
+            self.song_queue.push_front(prefetched[1]["id"])
+        source = self.voice_client.source if self.is_active() else None
+        if not isinstance(source, GaplessSource):
+            return
+        source.prefetch_requested = False
+        # La canción actual se reabre desde donde va, con el nuevo volumen
+        song_data, frame = source.song_data, source.frames_played
+        replacement = await self.open_source(song_data, source.position())
+        if self.voice_client and self.voice_client.source is source:
+            source.replace(replacement, song_data, frame)
+        else:
+            replacement.cleanup()
+
+    async def announce(self, song_data):
+        self.now_playing = song_data["title"]
+        log.info("reproduciendo", guild=self.guild.id, song=song_data["id"], title=self.now_playing)
+        try:
+            thumbnail_url, cover_file, cover_key = await self.cover(song_data)
+            # Enviar el mensaje embed con la miniatura adjunta
+            message = await self.channel.send(embed=now_playing_embed(song_data, thumbnail_url), file=cover_file)
+            if cover_key:
+                # Las siguientes canciones del álbum usarán la URL del CDN sin volver a subirla
+                await self.registry.thumbnails.remember(cover_key, message)
+        except Exception as e:
+            log.error("error al anunciar la canción", guild=self.guild.id, error=e)
+
+    async def cover(self, song_data):
+        # Devuelve (URL para el embed, archivo a adjuntar o None, clave para recordar la URL)
+        cover_path = song_data.get("cover_path")
+        if not cover_path:
+            return None, None, None
+        thumbnails = self.registry.thumbnails
+        if thumbnails is None:
+            cover_file = discord.File(cover_path, filename=os.path.basename(cover_path))
+            return f"attachment://{cover_file.filename}", cover_file, None
+        key = thumbnails.key(cover_path)
+        url = thumbnails.url(key)
+        if url:
+            return url, None, None
+        path = await thumbnails.thumbnail(cover_path, key)
+        cover_file = discord.File(path, filename=os.path.basename(path))
+        return f"attachment://{cover_file.filename}", cover_file, key
+
+    def request_prefetch(self):
+        # Llamado desde el hilo de audio cuando la canción actual está por terminar
+        asyncio.run_coroutine_threadsafe(self.prefetch(), self.bot.loop)
+
+    async def prefetch(self):
+        if self.prefetched is not None or self.prefetching:
+            return
+        self.prefetching = True
+        generation = self.generation
+        song_data = None
+        try:
+            song_data = await self.next_song()
+            if song_data is not None:
+                source = await self.open_source(song_data)
+        except Exception as e:
+            self.prefetching = False
+            if isinstance(e, AdmissionTimeout):
+                log.warning("sin procesos de FFmpeg libres", guild=self.guild.id, error=e)
+                if self.channel:
+                    await self.channel.send(BUSY_MESSAGE)
+            else:
+                log.error("error al preparar la siguiente canción", guild=self.guild.id, error=e)
+            # La canción vuelve al principio de la cola para intentarlo al reproducirla (salvo tras !stop)
+            if song_data is not None and generation == self.generation:
+                self.song_queue.push_front(song_data["id"])
+            self.resume_if_idle()
+            return
+        finally:
+            self.prefetching = False
+        if song_data is None:
+            # La canción actual pudo terminar mientras se consultaba la base de datos
+            self.resume_if_idle()
+            return
+        if generation != self.generation:
+            # Se detuvo la reproducción mientras se esperaba el permiso
+            source.cleanup()
+            self.resume_if_idle()
+            return
+        with self.prefetch_lock:
+            self.prefetched = (source, song_data)
+        if not self.is_active():
+            # La canción anterior terminó antes de que esta estuviera lista
+            await self.play_song()
+
+    def resume_if_idle(self):
+        # song_finished() no hace nada mientras se prepara la siguiente canción: si la actual
+        # terminó entretanto, se retoma aquí (siguiente canción o temporizador de inactividad)
+        if not self.is_active():
+            self.song_finished()
+
+    def take_prefetched(self):
+        # Puede llamarse desde el hilo de audio (GaplessSource) o desde el event loop
+        with self.prefetch_lock:
+            prefetched, self.prefetched = self.prefetched, None
+        return prefetched
+
+    def discard_prefetched(self):
+        prefetched = self.take_prefetched()
+        if prefetched:
+            prefetched[0].cleanup()
+
+    def up_next(self):
+        prefetched = self.prefetched
+        return prefetched[1] if prefetched else None
+
+    def track_started(self, song_data):
+        # Llamado desde el hilo de audio cuando GaplessSource pasa a la siguiente canción
+        asyncio.run_coroutine_threadsafe(self.announce(song_data), self.bot.loop)
+
+    async def next_song(self):
+        # Las canciones que ya no están en la base de datos (p. ej. borradas tras una recarga) se saltan
+        while self.song_queue:
+            song_data = await self.registry.resolve(self.song_queue.pop())
+            if song_data is not None:
+                return song_data
+        return None
+
+    def song_finished(self):
+        # El reproductor pudo eliminarse (desconexión) mientras sonaba la última canción
+        if self.registry.find(self.guild.id) is not self:
+            return
+        # Si se está preparando la siguiente, prefetch() la reproducirá al terminar
+        if self.prefetching:
+            return
+        # Verificar si hay más canciones en la cola
+        if not self.song_queue and self.prefetched is None:
+            # Si no hay más canciones, reiniciar el temporizador
+            self.now_playing = None
+            self.reset_disconnect_timer()
+        else:
+            # Si hay más canciones en la cola, reproducir la siguiente
+            self.finished_at = time.perf_counter()
+            self.bot.loop.create_task(self.play_song())
+
+    def skip(self):
+        # Al detener la fuente, discord.py llama a song_finished, que pasa a la siguiente
+        self.voice_client.stop()
+
+    def stop(self):
+        self.generation += 1
+        self.song_queue.clear()  # Limpia la cola de reproducción
+        self.discard_prefetched()
+        self.voice_client.stop()
+
+    async def disconnect(self):
+        self.generation += 1
+        self.song_queue.clear()
+        self.discard_prefetched()
+        self.cancel_disconnect_timer()
+        if self.voice_client:
+            await self.voice_client.disconnect()
+        self.registry.remove(self.guild.id)
+
+    def reset_disconnect_timer(self):
+        # Cancela el temporizador de desconexión si existe
+        self.cancel_disconnect_timer()
+        # Programa la desconexión después de 3 minutos
+        self.disconnect_timer = self.bot.loop.create_task(self.disconnect_after_timeout())
+
+    def cancel_disconnect_timer(self):
+        if self.disconnect_timer and self.disconnect_timer is not asyncio.current_task():
+            self.disconnect_timer.cancel()
+        self.disconnect_timer = None
+
+    async def disconnect_after_timeout(self):
+        log.debug("desconexión automática programada", guild=self.guild.id, seconds=IDLE_TIMEOUT)
+        await asyncio.sleep(IDLE_TIMEOUT)
+        log.info("desconectado por inactividad", guild=self.guild.id)
+        await self.disconnect()
+
+
+class PlayerRegistry:
+    # Un GuildPlayer por servidor, creado al usarse por primera vez y eliminado al desconectarse
+    def __init__(self, bot, resolve, scheduler, opus_cache=None, opus_bitrate=96, normalize=True, thumbnails=None):
+        self.bot = bot
+        self.resolve = resolve  # corrutina: id de canción -> canción de la base de datos actual
+        self.scheduler = scheduler  # Límite global de procesos de FFmpeg
+        self.opus_cache = opus_cache
+        self.opus_bitrate = opus_bitrate
+        self.normalize = normalize  # Aplicar la ganancia de cada pista (ReplayGain/EBU R128)
+        self.thumbnails = thumbnails  # Miniaturas de portadas y URL ya subidas a Discord
+        self.players = {}
+
+    def get(self, guild):
+        player = self.players.get(guild.id)
+        if player is None:
+            player = self.players[guild.id] = GuildPlayer(self.bot, guild, self)
+        return player
+
+    def find(self, guild_id):
+        return self.players.get(guild_id)
+
+    def remove(self, guild_id):
+        player = self.players.pop(guild_id, None)
+        if player:
+            player.generation += 1
+            player.song_queue.clear()
+            player.discard_prefetched()
+            player.cancel_disconnect_timer()
+        # Procesos de FFmpeg que pudieran quedar de ese servidor
+        self.scheduler.kill_owner(guild_id)
+        return player
+
+    def reap(self):
+        # Elimina los reproductores de servidores donde el bot ya no está conectado y no queda nada pendiente
+        for guild_id, player in list(self.players.items()):
+            if player.voice_client is None and not player.song_queue and player.prefetched is None and not player.prefetching:
+                self.remove(guild_id)
@@ -0,0 +1,56 @@
+import random
+from collections import deque
+from itertools import islice
+
+
+class TrackQueue:
+    # Cola de reproducción de ids de canciones. Guarda solo el id (no una copia de la
+    # canción): la canción se busca en la base de datos al llegar su turno.
+    # Sacar, añadir y consultar la siguiente es O(1); quitar o mover una posición cuesta
+    # lo que la distancia al extremo más cercano de la cola (deque.rotate).
+    def __init__(self):
+        self.tracks = deque()
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __bool__(self):
+        return bool(self.tracks)
+
+    def append(self, track_id):
+        self.tracks.append(track_id)
+
+    def extend(self, track_ids):
+        self.tracks.extend(track_ids)
+
+    def push_front(self, track_id):
+        self.tracks.appendleft(track_id)
+
+    def pop(self):
+        return self.tracks.popleft() if self.tracks else None
+
+    def peek(self):
+        return self.tracks[0] if self.tracks else None
+
+    def remove(self, index):
+        track_id = self.tracks[index]
+        del self.tracks[index]
+        return track_id
+
+    def move(self, source, destination):
+        track_id = self.remove(source)
+        self.tracks.insert(destination, track_id)
+        return track_id
+
+    def shuffle(self):
+        # random.shuffle sobre un deque accede por índice (O(n²)); con una lista es O(n)
+        tracks = list(self.tracks)
+        random.shuffle(tracks)
+        self.tracks = deque(tracks)
+
+    def clear(self):
+        self.tracks.clear()
+
+    def page(self, start, size):
+        # Solo recorre hasta el final de la página pedida, no toda la cola
+        return list(islice(self.tracks, start, start + size))
@@ -0,0 +1,180 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+from metrics import counter, gauge_callback, histogram
+
+LIVE = 0  # Reproducción: siempre tiene prioridad
+BACKGROUND = 1  # Codificaciones para la caché, análisis, etc.
+PRIORITY_NAMES = {LIVE: "live", BACKGROUND: "background"}
+# Un FFmpeg que codifica una canción a Opus en tiempo real usa un par de centésimas de núcleo
+# (reempaquetar una copia de la caché, mucho menos); el análisis y las codificaciones de la
+# caché van tan rápido como pueden y ocupan un núcleo cada uno
+PROCESSES_PER_CORE = 16
+MIN_PROCESSES = 32
+CORES = os.cpu_count() or 1
+
+FIRST_FRAME = histogram("ffmpeg_first_frame_seconds", "Desde que se lanza FFmpeg hasta su primer frame de audio")
+SPAWNED = counter("ffmpeg_spawned_total", "Procesos de FFmpeg admitidos", ("priority",))
+FAILURES = counter("ffmpeg_failures_total", "Procesos de FFmpeg que no entregaron audio")
+TIMEOUTS = counter("ffmpeg_admission_timeouts_total", "Peticiones rechazadas por esperar demasiado un proceso libre")
+
+
+class AdmissionTimeout(Exception):
+    pass
+
+
+def default_limit():
+    # Cada servidor que reproduce ocupa un proceso (dos mientras prepara la siguiente canción)
+    return max(MIN_PROCESSES, PROCESSES_PER_CORE * CORES)
+
+
+def default_background_limit(limit):
+    return max(1, min(limit // 2, CORES))
+
+
+class ProcessSlot:
+    # Permiso para tener un proceso de FFmpeg en marcha. Se libera una sola vez, desde
+    # cualquier hilo (el reproductor de discord.py limpia las fuentes en su propio hilo).
+    def __init__(self, scheduler, priority, owner):
+        self.scheduler = scheduler
+        self.priority = priority
+        self.owner = owner
+        self.source = None
+        self.released = False
+        self.lock = threading.Lock()
+
+    def attach(self, source):
+        # Fuente (o proceso) que se cierra si hay que matar los procesos de su dueño
+        self.source = source
+
+    def release(self):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+        self.scheduler.release(self)
+
+    def kill(self):
+        if self.source is not None:
+            self.source.cleanup()
+        self.release()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+
+class FFmpegScheduler:
+    # Controla cuántos procesos de FFmpeg hay a la vez. Cuando se alcanza el límite las
+    # peticiones esperan en una cola con prioridad (la reproducción va antes que las tareas
+    # en segundo plano) y fallan con AdmissionTimeout si la espera supera `timeout`.
+    def __init__(self, limit, background_limit=None, timeout=10.0):
+        self.limit = limit
+        self.background_limit = background_limit or default_background_limit(limit)
+        self.timeout = timeout
+        self.running = {LIVE: 0, BACKGROUND: 0}
+        self.waiters = []  # montículo de (prioridad, orden de llegada, future)
+        self.order = itertools.count()
+        self.owners = {}  # dueño (id del servidor) -> procesos activos
+        self.loop = None
+        # Estadísticas
+        self.spawned = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last_first_frame_ms = None
+        gauge_callback("ffmpeg_running", "Procesos de FFmpeg en marcha", ("priority",),
+                       lambda: [((PRIORITY_NAMES[p],), n) for p, n in self.running.items()])
+        gauge_callback("ffmpeg_waiting", "Peticiones esperando un proceso de FFmpeg", (),
+                       lambda: [((), sum(1 for _, _, f in self.waiters if not f.done()))])
+
+    def total_running(self):
+        return sum(self.running.values())
+
+    def can_admit(self, priority):
+        if self.total_running() >= self.limit:
+            return False
+        return priority == LIVE or self.running[BACKGROUND] < self.background_limit
+
+    async def acquire(self, priority=LIVE, owner=None, timeout=None):
+        self.loop = asyncio.get_running_loop()
+        # Sin nadie esperando con igual o mayor prioridad, se entra directamente
+        if self.can_admit(priority) and not any(p <= priority for p, _, f in self.waiters if not f.done()):
+            return self.admit(priority, owner)
+
+        future = self.loop.create_future()
+        heapq.heappush(self.waiters, (priority, next(self.order), future))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            if not future.done():
+                future.cancel()
+                self.timeouts += 1
+                TIMEOUTS.inc()
+                raise AdmissionTimeout(f"No hay procesos de FFmpeg libres (límite: {self.limit}).")
+        except asyncio.CancelledError:
+            if not future.cancel():
+                # Se concedió justo al cancelar: se devuelve el permiso
+                self.release_now(priority)
+            raise
+        return self.admit(priority, owner, counted=True)
+
+    def admit(self, priority, owner, counted=False):
+        if not counted:
+            self.running[priority] += 1
+        self.spawned += 1
+        SPAWNED.labels(PRIORITY_NAMES[priority]).inc()
+        slot = ProcessSlot(self, priority, owner)
+        self.owners.setdefault(owner, set()).add(slot)
+        return slot
+
+    def release(self, slot):
+        # Puede llamarse desde otro hilo
+        if self.loop is None or self.loop.is_closed():
+            return
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if running_loop is self.loop:
+            self.forget(slot)
+        else:
+            self.loop.call_soon_threadsafe(self.forget, slot)
+
+    def forget(self, slot):
+        slots = self.owners.get(slot.owner)
+        if slots is not None:
+            slots.discard(slot)
+            if not slots:
+                del self.owners[slot.owner]
+        self.release_now(slot.priority)
+
+    def release_now(self, priority):
+        self.running[priority] -= 1
+        # Se despierta al siguiente en espera que quepa, por orden de prioridad
+        while self.waiters:
+            waiter_priority, _, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+            if not self.can_admit(waiter_priority):
+                break
+            heapq.heappop(self.waiters)
+            self.running[waiter_priority] += 1
+            future.set_result(None)
+
+    def record_first_frame(self, elapsed_ms):
+        self.last_first_frame_ms = elapsed_ms
+        FIRST_FRAME.observe(elapsed_ms / 1000)
+
+    def record_failure(self):
+        self.failures += 1
+        FAILURES.inc()
+
+    def kill_owner(self, owner):
+        # Cierra los procesos que quedaron huérfanos al desconectarse un servidor
+        for slot in list(self.owners.get(owner, ())):
+            slot.kill()
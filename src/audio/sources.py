@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+import discord
+from metrics import histogram
+
+FRAME_MS = 20  # discord.py lee y envía audio en frames de 20 ms
+PREBUFFER_FRAMES = 50  # Frames que se leen por adelantado de la siguiente canción (1 s)
+PREFETCH_SECONDS = 8  # Antes del final de la canción actual se prepara la siguiente
+
+# Silencio entre el último frame de una canción y el primero de la siguiente
+TRACK_GAP = histogram("track_gap_seconds", "Pausa entre canciones", ("gapless",),
+                      buckets=(0.001, 0.02, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+
+def duration_seconds(song_data):
+    # "mm:ss" (o "mmm:ss" para pistas de más de 99 minutos) -> segundos
+    try:
+        minutes, seconds = song_data["duration"].split(":")
+        return int(minutes) * 60 + int(seconds)
+    except (KeyError, ValueError, AttributeError):
+        return None
+
+
+class PrefetchedSource(discord.AudioSource):
+    # Arranca FFmpeg de inmediato y un hilo lee los primeros frames, así la canción
+    # empieza a sonar sin esperar a que el proceso arranque
+    def __init__(self, source, frames=PREBUFFER_FRAMES, slot=None, started=None):
+        self.source = source
+        self.slot = slot  # Permiso del FFmpegScheduler, se libera en cleanup()
+        self.created = started or time.perf_counter()  # Momento en que se lanzó FFmpeg
+        self.buffer = deque()
+        self.exhausted = False
+        self.ready = threading.Event()
+        threading.Thread(target=self.fill, args=(frames,), daemon=True).start()
+
+    def fill(self, frames):
+        try:
+            for _ in range(frames):
+                data = self.source.read()
+                if not data:
+                    self.exhausted = True
+                    break
+                if not self.buffer and self.slot:
+                    # Tiempo desde que se lanzó FFmpeg hasta el primer frame
+                    self.slot.scheduler.record_first_frame((time.perf_counter() - self.created) * 1000)
+                self.buffer.append(data)
+        except Exception:
+            self.exhausted = True
+        finally:
+            if not self.buffer and self.slot:
+                self.slot.scheduler.record_failure()
+            self.ready.set()
+
+    def read(self):
+        self.ready.wait()
+        if self.buffer:
+            return self.buffer.popleft()
+        if self.exhausted:
+            return b""
+        return self.source.read()
+
+    def is_opus(self):
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+        if self.slot:
+            self.slot.release()
+
+
+class GaplessSource(discord.AudioSource):
+    # Fuente que encadena canciones sin cortar el reproductor de discord.py: cuando la
+    # canción actual está por terminar pide al GuildPlayer que prepare la siguiente, y al
+    # acabar cambia a ella en el mismo read(), sin crear otro AudioPlayer ni esperar.
+    def __init__(self, player, source, song_data, gap_started=None):
+        self.player = player
+        self.lock = threading.Lock()
+        self.replacement = None  # (fuente, canción, frame en que se abrió) pendiente de cambiar
+        self.gap_started = gap_started  # Fin de la canción anterior, para medir la pausa
+        self.start(source, song_data)
+
+    def start(self, source, song_data):
+        self.current = source
+        self.song_data = song_data
+        self.frames_played = 0
+        self.prefetch_requested = False
+        duration = duration_seconds(song_data)
+        # Sin duración conocida se prepara la siguiente desde el principio
+        self.frames_left = (duration - PREFETCH_SECONDS) * 1000 // FRAME_MS if duration else 0
+
+    def position(self):
+        # Segundos reproducidos de la canción actual
+        return self.frames_played * FRAME_MS / 1000
+
+    def replace(self, source, song_data, frame):
+        # Cambia la canción actual por la misma abierta desde `frame` (p. ej. con otro volumen).
+        # El cambio lo hace el hilo de audio en su siguiente read()
+        with self.lock:
+            previous, self.replacement = self.replacement, (source, song_data, frame)
+        if previous:
+            previous[0].cleanup()
+
+    def read(self):
+        if self.replacement:
+            with self.lock:
+                source, song_data, frame = self.replacement
+                self.replacement = None
+            if song_data is not self.song_data:
+                # Mientras tanto ya empezó la siguiente canción
+                source.cleanup()
+            else:
+                self.current.cleanup()
+                self.current = source
+                # Mientras arrancaba FFmpeg siguió sonando la fuente anterior: se descarta lo ya oído
+                for _ in range(self.frames_played - frame):
+                    self.current.read()
+
+        data = self.current.read()
+        if data:
+            if self.gap_started is not None:
+                TRACK_GAP.labels("false").observe(time.perf_counter() - self.gap_started)
+                self.gap_started = None
+            self.frames_played += 1
+            self.frames_left -= 1
+            if not self.prefetch_requested and self.frames_left <= 0:
+                self.prefetch_requested = True
+                self.player.request_prefetch()
+            return data
+
+        # Terminó la canción: si la siguiente ya está lista se cambia sin pausa
+        ended = time.perf_counter()
+        prefetched = self.player.take_prefetched()
+        if prefetched is None:
+            return b""
+        source, song_data = prefetched
+        self.current.cleanup()
+        self.start(source, song_data)
+        self.player.track_started(song_data)
+        data = self.current.read()
+        TRACK_GAP.labels("true").observe(time.perf_counter() - ended)
+        if data:
+            self.frames_played += 1
+            self.frames_left -= 1
+        return data
+
+    def is_opus(self):
+        return self.current.is_opus()
+
+    def cleanup(self):
+        self.current.cleanup()
+        with self.lock:
+            replacement, self.replacement = self.replacement, None
+        if replacement:
+            replacement[0].cleanup()
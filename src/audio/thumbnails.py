@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import os
+import time
+from urllib.parse import parse_qs, urlparse
+from audio.scheduler import BACKGROUND
+from library.storage import read_json, write_json
+from logs import get_logger
+
+log = get_logger(__name__)
+
+THUMBNAILS_FOLDER = os.path.join("data", "thumbnails")
+URLS_FILENAME = "urls.json"
+THUMBNAIL_SIZE = 320  # Lado máximo en píxeles; Discord muestra la miniatura a 80 px
+URL_MARGIN = 3600  # Segundos antes de que caduque una URL en que se deja de usar
+
+
+def url_expiry(url):
+    # Las URL de adjuntos del CDN de Discord están firmadas y caducan: el parámetro `ex`
+    # es el instante de caducidad en hexadecimal. Sin él se considera que no caduca.
+    try:
+        return int(parse_qs(urlparse(url).query)["ex"][0], 16)
+    except (KeyError, IndexError, ValueError):
+        return None
+
+
+class ThumbnailCache:
+    # Miniaturas pequeñas de las portadas (un escaneo de 10 MB tarda en subirse en cada
+    # canción) y las URL que devuelve Discord tras la primera subida, para que las
+    # siguientes canciones del mismo álbum usen la URL sin volver a subir nada.
+    def __init__(self, scheduler, size=THUMBNAIL_SIZE, folder=THUMBNAILS_FOLDER):
+        self.scheduler = scheduler
+        self.size = size
+        self.folder = folder
+        self.urls_path = os.path.join(folder, URLS_FILENAME)
+        self.urls = {}  # clave de la portada -> URL del CDN
+        self.pending = {}  # clave -> tarea que está generando la miniatura
+        os.makedirs(folder, exist_ok=True)
+        now = time.time()
+        for key, url in read_json(self.urls_path, {}).items():
+            expiry = url_expiry(url)
+            if expiry is None or expiry - URL_MARGIN > now:
+                self.urls[key] = url
+
+    def key(self, cover_path):
+        # Cambia si se reemplaza la imagen de la portada
+        stat = os.stat(cover_path)
+        signature = f"{os.path.normpath(cover_path)}:{stat.st_size}:{stat.st_mtime_ns}:{self.size}"
+        return hashlib.sha1(signature.encode()).hexdigest()
+
+    def url(self, key):
+        url = self.urls.get(key)
+        if url is None:
+            return None
+        expiry = url_expiry(url)
+        if expiry is not None and expiry - URL_MARGIN <= time.time():
+            del self.urls[key]
+            return None
+        return url
+
+    async def remember(self, key, message):
+        # La miniatura adjunta aparece en el embed con su URL definitiva del CDN
+        url = None
+        if message.embeds and message.embeds[0].thumbnail and message.embeds[0].thumbnail.url:
+            url = message.embeds[0].thumbnail.url
+        elif message.attachments:
+            url = message.attachments[0].url
+        if url and url.startswith("https://"):
+            self.urls[key] = url
+            await asyncio.to_thread(write_json, self.urls_path, dict(self.urls))
+
+    async def thumbnail(self, cover_path, key):
+        # Devuelve la ruta de la miniatura, generándola la primera vez. Si no se puede
+        # generar (p. ej. FFmpeg saturado) se usa la portada original
+        path = os.path.join(self.folder, f"{key}.jpg")
+        if not self.size or os.path.exists(path):
+            return path if self.size else cover_path
+        task = self.pending.get(key)
+        if task is None:
+            task = self.pending[key] = asyncio.create_task(self.generate(cover_path, path))
+            task.add_done_callback(lambda _: self.pending.pop(key, None))
+        try:
+            await asyncio.shield(task)
+            return path
+        except Exception as e:
+            log.warning("error al generar la miniatura", path=cover_path, error=e)
+            return cover_path
+
+    async def generate(self, cover_path, path):
+        tmp_path = path[:-len(".jpg")] + f".{os.getpid()}.tmp.jpg"  # Varios procesos de audio comparten la carpeta
+        async with await self.scheduler.acquire(BACKGROUND):
+            process = await asyncio.create_subprocess_exec(
+                "ffmpeg", "-nostdin", "-loglevel", "error", "-y", "-i", cover_path,
+                # Solo se reduce, nunca se amplía; se conserva la proporción
+                "-vf", f"scale='min({self.size},iw)':'min({self.size},ih)':force_original_aspect_ratio=decrease",
+                "-frames:v", "1", "-q:v", "5", tmp_path,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            _, stderr = await process.communicate()
+        if process.returncode != 0:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise RuntimeError(stderr.decode(errors="replace").strip())
+        os.replace(tmp_path, path)
@@ -0,0 +1,162 @@
+import asyncio
+import itertools
+import json
+import struct
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Canal local entre el coordinador y los procesos de audio: mensajes JSON precedidos por
+# su longitud (4 bytes). Peticiones {"id", "method", "params"} y respuestas {"id", "result"}
+# o {"id", "error"}; el coordinador también puede enviar eventos {"event", "data"}.
+HEADER = struct.Struct(">I")
+MAX_MESSAGE = 64 * 1024 * 1024
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9120
+
+
+class IPCError(Exception):
+    pass
+
+
+async def read_message(reader):
+    size = HEADER.unpack(await reader.readexactly(HEADER.size))[0]
+    if size > MAX_MESSAGE:
+        raise IPCError(f"Mensaje demasiado grande: {size} bytes")
+    return json.loads(await reader.readexactly(size))
+
+
+def write_message(writer, message):
+    data = json.dumps(message, separators=(",", ":")).encode()
+    writer.write(HEADER.pack(len(data)) + data)
+
+
+class Connection:
+    # Un proceso de audio conectado al coordinador
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.worker = None  # Se conoce al recibir "hello"
+
+    def send(self, message):
+        if not self.writer.is_closing():
+            write_message(self.writer, message)
+
+    def event(self, name, data=None):
+        self.send({"event": name, "data": data})
+
+
+class IPCServer:
+    # `handlers`: nombre del método -> corrutina(connection, **params). Cada petición se
+    # atiende en su propia tarea, así una espera larga (p. ej. "identify") no bloquea las demás
+    def __init__(self, handlers, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.handlers = handlers
+        self.host = host
+        self.port = port
+        self.server = None
+        self.connections = set()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        return self
+
+    async def close(self):
+        if self.server:
+            self.server.close()
+        for connection in list(self.connections):
+            connection.writer.close()
+
+    async def serve(self, reader, writer):
+        connection = Connection(reader, writer)
+        self.connections.add(connection)
+        tasks = set()
+        try:
+            while True:
+                message = await read_message(reader)
+                task = asyncio.create_task(self.dispatch(connection, message))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError, IPCError, ValueError):
+            pass
+        finally:
+            self.connections.discard(connection)
+            for task in tasks:
+                task.cancel()
+            writer.close()
+            log.info("proceso de audio desconectado", worker=connection.worker)
+
+    async def dispatch(self, connection, message):
+        handler = self.handlers.get(message.get("method"))
+        try:
+            if handler is None:
+                raise IPCError(f"Método desconocido: {message.get('method')}")
+            response = {"id": message["id"], "result": await handler(connection, **message.get("params", {}))}
+        except Exception as e:
+            log.error("error al atender la petición", method=message.get("method"), error=e)
+            response = {"id": message["id"], "error": str(e)}
+        connection.send(response)
+
+    def find(self, worker):
+        return next((connection for connection in self.connections if connection.worker == worker), None)
+
+
+class IPCClient:
+    # Lado del proceso de audio. Si se pierde la conexión fallan las peticiones pendientes
+    # y se llama a `on_lost`: sin coordinador el proceso no tiene base de datos
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, on_event=None, on_lost=None):
+        self.host = host
+        self.port = port
+        self.on_event = on_event  # corrutina(nombre, datos)
+        self.on_lost = on_lost
+        self.ids = itertools.count()
+        self.pending = {}
+        self.writer = None
+        self.reader_task = None
+
+    async def connect(self):
+        reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reader_task = asyncio.create_task(self.read(reader))
+        return self
+
+    async def close(self):
+        self.on_lost = None  # Cierre voluntario
+        if self.reader_task:
+            self.reader_task.cancel()
+        if self.writer:
+            self.writer.close()
+
+    async def read(self, reader):
+        try:
+            while True:
+                message = await read_message(reader)
+                if "event" in message:
+                    if self.on_event:
+                        asyncio.create_task(self.on_event(message["event"], message.get("data")))
+                    continue
+                future = self.pending.pop(message.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in message:
+                    future.set_exception(IPCError(message["error"]))
+                else:
+                    future.set_result(message.get("result"))
+        except (asyncio.IncompleteReadError, ConnectionError, IPCError, ValueError) as e:
+            log.error("conexión con el coordinador perdida", error=e)
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(IPCError("Sin conexión con el coordinador"))
+            self.pending.clear()
+            if self.on_lost:
+                self.on_lost()
+
+    async def call(self, method, timeout=None, **params):
+        if self.writer is None or self.writer.is_closing():
+            raise IPCError("Sin conexión con el coordinador")
+        request_id = next(self.ids)
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        write_message(self.writer, {"id": request_id, "method": method, "params": params})
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(request_id, None)
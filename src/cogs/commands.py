@@ -1,95 +1,272 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
-import os
 import asyncio
-import json
-from mutagen import File
-from difflib import SequenceMatcher
+import time
 from decouple import config
+from audio.opus_cache import OpusCache
+from audio.player import MAX_VOLUME, PlayerRegistry
+from audio.scheduler import AdmissionTimeout, FFmpegScheduler, default_limit
+from audio.thumbnails import THUMBNAIL_SIZE, ThumbnailCache
+from library.prefix import CHOICE_LENGTH, PrefixIndex
+from library.ranking import rank_by_similarity
+from library.search import normalize
+from library.storage import open_store
+from logs import get_logger
+from metrics import gauge_callback, histogram
+
+QUEUE_PAGE_SIZE = 10  # Canciones por página en !queue
+
+log = get_logger(__name__)
+SEARCH_TIME = histogram("search_seconds", "Tiempo de búsqueda en la base de datos", ("field",))
+RANKING_TIME = histogram("ranking_seconds", "Tiempo de ordenar los resultados por similitud")
+AUTOCOMPLETE_TIME = histogram("autocomplete_seconds", "Tiempo de calcular las sugerencias de /play")
 
 class Commands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.song_queue = []
-        self.now_playing = None
-        self.song_database = None
-        self.disconnect_timer = None  # Temporizador de desconexin
+        self.opus_bitrate = config("OPUS_BITRATE", default=96, cast=int)
+        self.normalize = config("NORMALIZE_LOUDNESS", default=True, cast=bool)
+        # Límite global de procesos de FFmpeg (reproducción + tareas en segundo plano)
+        self.ffmpeg = FFmpegScheduler(
+            config("FFMPEG_MAX_PROCESSES", default=default_limit(), cast=int),
+            background_limit=config("FFMPEG_BACKGROUND_PROCESSES", default=0, cast=int) or None,
+            timeout=config("FFMPEG_ADMISSION_TIMEOUT", default=10.0, cast=float),
+        )
+        # En el modo con varios procesos la base de datos y las búsquedas están en el coordinador
+        self.cluster = getattr(bot, "cluster", None)
+        self.players = PlayerRegistry(bot, self.get_song, self.ffmpeg, opus_bitrate=self.opus_bitrate, normalize=self.normalize)  # Un reproductor por servidor
+        self.store = None  # Base de datos de canciones (JSON en memoria o SQLite)
+        self.store_total = 0
+        self.suggestions = PrefixIndex(())  # Índice de prefijos para el autocompletado de /play
+        self.reload_lock = asyncio.Lock()
+        self.loading = None  # Carga inicial de la base de datos, en segundo plano
+        gauge_callback("queue_depth", "Canciones en la cola de cada servidor", ("guild",),
+                       lambda: [((guild_id,), len(player.song_queue)) for guild_id, player in list(self.players.players.items())])
+        if not self.cluster:
+            gauge_callback("songs", "Canciones en la base de datos cargada", (), lambda: [((), self.store_total)])
+
+    async def cog_load(self):
+        # La base de datos se carga una sola vez al arrancar, fuera del event loop y sin
+        # retrasar la conexión con Discord (no en cada on_ready, que se repite al reconectar)
+        if self.cluster:
+            # El coordinador la carga antes de lanzar los procesos de audio
+            self.bot.mark("database")
+        else:
+            self.loading = asyncio.create_task(self.initial_load())
+        # Miniaturas de las portadas (THUMBNAIL_SIZE=0 adjunta la portada original)
+        self.players.thumbnails = ThumbnailCache(self.ffmpeg, size=config("THUMBNAIL_SIZE", default=THUMBNAIL_SIZE, cast=int))
+        # Caché opcional de copias en Opus (OPUS_CACHE_SIZE_MB=0 la desactiva)
+        cache_mb = config("OPUS_CACHE_SIZE_MB", default=0, cast=int)
+        if cache_mb > 0:
+            self.players.opus_cache = OpusCache(
+                cache_mb * 1024 * 1024,
+                self.ffmpeg,
+                bitrate=self.opus_bitrate,
+                workers=config("OPUS_CACHE_WORKERS", default=1, cast=int),
+                normalize=self.normalize,
+            )
 
-        
-    @commands.Cog.listener()
-    async def on_ready(self):
-        print("Cog de Comandos cargado correctamente.")
-        self.load_song_database()  # Cargamos la base de datos de canciones cuando el bot est listo
+    async def cog_unload(self):
+        if self.loading:
+            self.loading.cancel()
+        if self.players.opus_cache:
+            self.players.opus_cache.close()
+
+    async def initial_load(self):
+        try:
+            stats = await self.load_song_database()
+            log.info("base de datos cargada", songs=stats["total"], elapsed_ms=round(stats["elapsed_ms"]))
+        except Exception as e:
+            log.error("error al cargar la base de datos de canciones", error=e)
+            return
+        if hasattr(self.bot, "mark"):
+            self.bot.mark("database")
+
+    async def database_ready(self):
+        # Los comandos que buscan canciones esperan a la carga inicial (solo justo al arrancar)
+        if self.loading and not self.loading.done():
+            await asyncio.shield(self.loading)
     
-    def load_song_database(self):
-        # Cargamos la base de datos de canciones desde el archivo JSON
-        with open("data/song_database.json", "r") as f:
-            self.song_database = json.load(f)
+    async def load_song_database(self):
+        # La lectura y la construcción de índices se hacen en un hilo para no bloquear el event loop
+        async with self.reload_lock:
+            start = time.perf_counter()
+            store, total, suggestions = await asyncio.to_thread(self.open_song_database)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # Una sola asignación: las búsquedas en curso siguen usando la base anterior hasta terminar
+            previous, previous_total = self.store, self.store_total
+            self.store, self.store_total, self.suggestions = store, total, suggestions
+            if previous:
+                previous.close()
+        return {"total": total, "delta": total - previous_total, "elapsed_ms": elapsed_ms}
+
+    def prewarm(self, songs):
+        opus_cache = self.players.opus_cache
+        if opus_cache and config("OPUS_CACHE_PREWARM", default=False, cast=bool):
+            for song_data in songs:
+                opus_cache.enqueue(song_data)
+
+    @commands.Cog.listener()
+    async def on_cluster_prewarm(self, songs):
+        # El coordinador reparte las canciones nuevas de un escaneo entre los procesos de audio
+        self.prewarm(songs)
+
+    async def apply_library_changes(self, changed, removed):
+        # Cambios incrementales del escáner (watcher o /gen_database) sobre la base cargada
+        async with self.reload_lock:
+            self.store.apply(changed, removed)
+            self.store_total = self.store.count()
+            # El índice de prefijos es una lista ordenada: se reconstruye fuera del event loop
+            self.suggestions = await asyncio.to_thread(lambda: PrefixIndex(self.store.all_songs()))
+
+    async def apply_gains(self, songs):
+        # Ganancias medidas en segundo plano: no cambian títulos ni artistas, no se reindexa nada
+        async with self.reload_lock:
+            self.store.replace(songs)
+
+    def open_song_database(self):
+        store = open_store(config("DATABASE_BACKEND", default="json")).load()
+        return store, store.count(), PrefixIndex(store.all_songs())
     
     @commands.command(brief="Recarga la base de datos de canciones desde el archivo JSON.", help="Recarga la base de datos de canciones desde el archivo JSON.", aliases=["rdb", "RDB"])
     async def reload_database(self, ctx):
-        self.load_song_database()
+        try:
+            if self.cluster:
+                stats = await self.cluster.call("reload")
+            else:
+                stats = await self.load_song_database()
+        except Exception as e:
+            log.error("error al recargar la base de datos", error=e)
+            await ctx.send(f"Error! no se pudo recargar la base de datos. \n```{e}```")
+            return
         image_url = "https://imgur.com/Zk27ucC.png"
-        cantidad = len(self.song_database)-10
         embed = discord.Embed(
                 title="Base de datos Recargada",
                 description=f"Se ha actualizado la lista de canciones.",
                 color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
             )
-        embed.add_field(name="Canciones", value=cantidad, inline=True)
+        embed.add_field(name="Canciones", value=stats["total"], inline=True)
+        embed.add_field(name="Cambio", value=f"{stats['delta']:+d}", inline=True)
+        embed.add_field(name="Tiempo de carga", value=f"{stats['elapsed_ms']:.0f} ms", inline=True)
         embed.set_image(url=image_url)
         await ctx.send(embed=embed)
+
     @commands.command(brief="Conecta el bot al canal de voz.", help="Conecta el bot al canal de voz.", aliases=["j", "J"])
     async def join(self, ctx):
         if ctx.author.voice:
             channel = ctx.author.voice.channel
             await channel.connect()
-            print(f"Bot conectado al canal de voz: {channel}")
+            log.info("conectado al canal de voz", guild=ctx.guild.id, channel=channel.name)
+            player = self.players.get(ctx.guild)
+            player.channel = ctx.channel
             # Cuando el bot se una al canal, iniciamos el temporizador
-            self.reset_disconnect_timer()
+            player.reset_disconnect_timer()
         else:
             await ctx.send("Primero debes estar en un canal de voz.")
     
     @commands.command(brief="Desconecta el bot del canal de voz.", help="Desconecta el bot del canal de voz.",aliases=["l", "L"])
     async def leave(self, ctx):
         if ctx.voice_client:
-            await ctx.voice_client.disconnect()
-            self.song_queue.clear()
-            self.cancel_disconnect_timer()  # Cancela el temporizador de desconexin si existe
-            print("Bot desconectado del canal de voz.")
+            # Limpia la cola y cancela el temporizador de desconexión si existe
+            await self.players.get(ctx.guild).disconnect()
+            log.info("desconectado del canal de voz", guild=ctx.guild.id)
         else:
             await ctx.send("No estoy en un canal de voz... ??")
-        # Cancela el temporizador de desconexin si se ejecuta el comando !leave
-        self.cancel_disconnect_timer()
 
-    @commands.command(brief="A?ade una cancin por nombre de archivo.", help="A?ade una cancin por nombre de archivo.\n\nParmetros:\n-s: Buscar por ttulo de la cancin.\n-a: Buscar por nombre del artista.\n-l: Buscar por nombre del lbum.", aliases=["p", "P"])
+    @commands.command(brief="Añade una canción por nombre de archivo.", help="Añade una canción por nombre de archivo.\n\nParámetros:\n-s: Buscar por título de la canción.\n-a: Buscar por nombre del artista.\n-l: Buscar por nombre del álbum.", aliases=["p", "P"])
     async def play(self, ctx, *, query):
-        # Convertir todos los comandos y argumentos a minsculas
+        await self.database_ready()
+        # Convertir todos los comandos y argumentos a minúsculas
         query = query.lower()
         if not ctx.voice_client:
             await ctx.invoke(self.join)
-            # Inicia el temporizador solo si el bot se une al canal de voz
-            self.reset_disconnect_timer()
+            if not ctx.voice_client:
+                return
+        player = self.players.get(ctx.guild)
+        player.channel = ctx.channel
         
         target_songs = await self.parse(query, ctx)
-        self.song_queue.extend(target_songs)
-        thumbnail_url = "https://imgur.com/IKsan7z.png"
+        if not target_songs:
+            return
+        player.song_queue.extend(song["id"] for song in target_songs)
 
-        if not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused():
-            await self.play_song(ctx)
+        if not player.is_active():
+            await player.play_song()
         else:
-            # Obtener el ttulo de la ltima cancin agregada a la cola
-            last_song_data = target_songs[-1]
-            last_song_title = last_song_data["title"]
-            last_artist = last_song_data["artist"]
-            # Crear un mensaje embed para notificar que la cancin se ha agregado a la cola
-            embed = discord.Embed(
-                title="Cancin Agregada a la Cola",
-                description=f"La cancin **{last_song_title}** de **{last_artist}** se ha agregado a la cola.",
-                color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
-            )
-            embed.set_thumbnail(url=thumbnail_url)
-            await ctx.send(embed=embed)
+            # Notificar con la última canción agregada a la cola
+            await ctx.send(embed=self.queued_embed(target_songs[-1]))
+
+    def queued_embed(self, last_song_data, thumbnail_url="https://imgur.com/IKsan7z.png"):
+        # Crear un mensaje embed para notificar que la canción se ha agregado a la cola
+        embed = discord.Embed(
+            title="Canción Agregada a la Cola",
+            description=f"La canción **{last_song_data['title']}** de **{last_song_data['artist']}** se ha agregado a la cola.",
+            color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
+        )
+        embed.set_thumbnail(url=thumbnail_url)
+        return embed
+
+    @app_commands.command(name="play", description="Reproduce una canción, un álbum o un artista")
+    @app_commands.describe(busqueda="Empieza a escribir un título, artista o álbum y elige una sugerencia")
+    async def play_slash(self, interaction: discord.Interaction, busqueda: str):
+        if not interaction.user.voice:
+            await interaction.response.send_message("Primero debes estar en un canal de voz.", ephemeral=True)
+            return
+        if self.loading and not self.loading.done():
+            # Justo al arrancar la base de datos puede seguir cargándose: la respuesta debe llegar en 3 segundos
+            await interaction.response.defer()
+            await self.database_ready()
+        target_songs = await self.resolve_choice(busqueda)
+        if not target_songs:
+            if interaction.response.is_done():
+                await interaction.followup.send("No se encontró ninguna canción.")
+            else:
+                await interaction.response.send_message("No se encontró ninguna canción.", ephemeral=True)
+            return
+        # Conectarse al canal de voz puede tardar más que los 3 segundos para responder
+        if not interaction.response.is_done():
+            await interaction.response.defer()
+        if not interaction.guild.voice_client:
+            await interaction.user.voice.channel.connect()
+        player = self.players.get(interaction.guild)
+        player.channel = interaction.channel
+        player.song_queue.extend(song["id"] for song in target_songs)
+        if player.is_active():
+            await interaction.followup.send(embed=self.queued_embed(target_songs[-1]))
+        else:
+            # El anuncio de "Reproduciendo" lo envía el reproductor al canal
+            await interaction.followup.send(f"Añadidas **{len(target_songs)}** canciones a la cola." if len(target_songs) > 1 else "Reproduciendo...")
+            await player.play_song()
+
+    @play_slash.autocomplete("busqueda")
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str):
+        with AUTOCOMPLETE_TIME.time():
+            if self.cluster:
+                suggestions = await self.cluster.call("suggest", query=current)
+            else:
+                suggestions = self.suggestions.suggest(current)
+        return [app_commands.Choice(name=name, value=value) for name, value in suggestions]
+
+    async def resolve_choice(self, value):
+        # Valor elegido en el autocompletado: "id:<id>", "artist:<artista>" o "album:<álbum>\x1f<artista>"
+        if not self.store and not self.cluster:
+            return []
+        kind, _, payload = value.partition(":")
+        if kind == "id" and payload.isdigit():
+            song_data = await self.get_song(int(payload))
+            return [song_data] if song_data else []
+        if kind in ("artist", "album"):
+            # El valor pudo recortarse a 100 caracteres: entonces se compara como prefijo
+            truncated = len(value) >= CHOICE_LENGTH
+            songs = await self.search(kind, payload.split("\x1f")[0])
+            return [song for song in songs if self.group_matches(song, kind, payload, truncated)]
+        # Texto escrito sin elegir sugerencia: la canción con el título más parecido
+        return self.rank(await self.search_by_song(value), value, limit=1)
+
+    def group_matches(self, song, kind, payload, truncated):
+        names = normalize(song["artist"]) if kind == "artist" else normalize(song["album"]) + "\x1f" + normalize(song["artist"])
+        return names.startswith(payload) if truncated else names == payload
     
     async def parse(self, query, ctx):
         play_args = query.split(" ")
@@ -98,20 +275,14 @@ class Commands(commands.Cog):
         if "-s" in play_args:
             song_index = play_args.index("-s") + 1
             song_query = " ".join(play_args[song_index:])
-            target_songs = self.search_by_song(song_query)
-
-            # Calcular la puntuacin de cada cancin basada en la similitud del ttulo con la consulta
-            for song in target_songs:
-                song["score"] = self.calculate_similarity(song["title"], song_query)
+            # Ordenar las canciones por similitud del título con la consulta, de mayor a menor
+            target_songs = self.rank(await self.search_by_song(song_query), song_query)
 
-            # Ordenar las canciones por puntuacin de mayor a menor
-            target_songs.sort(key=lambda x: x["score"], reverse=True)
-
-            if len(target_songs) > 1:  # Si hay ms de una cancin con el mismo nombre
+            if len(target_songs) > 1:  # Si hay más de una canción con el mismo nombre
                 # Crear un mensaje embed con la lista de canciones
                 thumbnail_url = "https://imgur.com/cG8hTZe.png"
                 embed = discord.Embed(
-                    title="Mltiples Canciones Encontradas",
+                    title="Múltiples Canciones Encontradas",
                     description="Se encontraron varias canciones con ese nombre. Por favor, elige una:",
                     color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
                 )
@@ -126,272 +297,196 @@ class Commands(commands.Cog):
                 try:
                     response = await self.bot.wait_for('message', check=check, timeout=30.0)  # Esperar la respuesta del usuario durante 30 segundos
 
-                    # Verificar si la respuesta es un nmero entero vlido dentro del rango de opciones
+                    # Verificar si la respuesta es un número entero válido dentro del rango de opciones
                     choice = int(response.content)
                     if 1 <= choice <= len(target_songs):
-                        # Obtener la cancin seleccionada
+                        # Obtener la canción seleccionada
                         selected_song = target_songs[choice - 1]
-                        # Agregar la cancin a la cola
-                        self.song_queue.append(selected_song)
-                        # Reproducir la cancin si no hay ninguna reproducindose
-                        if not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused():
-                            await self.play_song(ctx)
+                        # Agregar la canción a la cola
+                        player = self.players.get(ctx.guild)
+                        player.song_queue.append(selected_song["id"])
+                        # Reproducir la canción si no hay ninguna reproduciéndose
+                        if not player.is_active():
+                            await player.play_song()
                         else:
-                            # Crear un mensaje embed para notificar que la cancin se ha agregado a la cola
+                            # Crear un mensaje embed para notificar que la canción se ha agregado a la cola
                             thumbnail_url = "https://imgur.com/IKsan7z.png"
                             
                             last_song_title = selected_song["title"]
                             last_artist = selected_song["artist"]
                             
                             embed = discord.Embed(
-                                title="Cancin Agregada a la Cola",
-                                description=f"La cancin **{last_song_title}** de **{last_artist}** se ha agregado a la cola.",
+                                title="Canción Agregada a la Cola",
+                                description=f"La canción **{last_song_title}** de **{last_artist}** se ha agregado a la cola.",
                                 color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
                             )
                             embed.set_thumbnail(url=thumbnail_url)
                             await ctx.send(embed=embed)
                                             
-                        # # Reproducir la cancin si no hay ninguna reproducindose
+                        # # Reproducir la canción si no hay ninguna reproduciéndose
                         # if not ctx.voice_client.is_playing() and not ctx.voice_client.is_paused():
                         #     await self.play_song(ctx)
                     else:
-                        await ctx.send("El nmero ingresado no corresponde a una cancin vlida.")
+                        await ctx.send("El número ingresado no corresponde a una canción válida.")
                 except asyncio.TimeoutError:
-                    await ctx.send("Se ha agotado el tiempo para seleccionar una cancin.")
+                    await ctx.send("Se ha agotado el tiempo para seleccionar una canción.")
                 return 
 
 
         elif "-a" in play_args:
             artist_index = play_args.index("-a") + 1
             artist_query = " ".join(play_args[artist_index:])
-            target_songs.extend(self.search_by_artist(artist_query))
+            target_songs.extend(await self.search_by_artist(artist_query))
         elif "-l" in play_args:
             album_index = play_args.index("-l") + 1
             album_query = " ".join(play_args[album_index:])
-            target_songs.extend(self.search_by_album(album_query))
+            target_songs.extend(await self.search_by_album(album_query))
 
         return target_songs
 
-    def search_by_artist(self, artist_query):
-        return [song for song in self.song_database if artist_query.lower() in song["artist"].lower()]
+    async def get_song(self, track_id):
+        # Siempre contra la base de datos actual, así las colas sobreviven a una recarga
+        if self.cluster:
+            return await self.cluster.call("get", track_id=track_id)
+        return self.store.get(track_id) if self.store else None
 
-    def search_by_album(self, album_query):
-        return [song for song in self.song_database if album_query.lower() in song["album"].lower()]
+    async def search(self, field, query):
+        with SEARCH_TIME.labels(field).time():
+            if self.cluster:
+                return await self.cluster.call("search", field=field, query=query)
+            return await self.store.search_async(field, query)
 
-    def search_by_song(self, song_query):
-        return [song for song in self.song_database if song_query.lower().replace("'", "") in song["title"].lower().replace("'", "")]
+    def rank(self, songs, query, **kwargs):
+        with RANKING_TIME.time():
+            return rank_by_similarity(songs, query, **kwargs)
 
-    def calculate_similarity(self, title, query):
-        # Calcular la similitud utilizando la funcin ratio de SequenceMatcher
-        similarity = SequenceMatcher(None, title.lower(), query.lower()).ratio()
-        return similarity
-    
-    async def play_selected_song(self, ctx, song_data):
-        try:
-            filepath = song_data["filepath"]
-            print(f"Ruta del archivo: {filepath}")  # Imprime la ruta del archivo
-            
-            # Obtener la imagen de la portada del archivo de audio
-            cover_path = song_data.get("cover_path")
-            # Crear el objeto discord.File con la imagen de la portada
-            if cover_path:
-                cover_file = discord.File(cover_path, filename=os.path.basename(cover_path))
-            else:
-                cover_file = None
-                
-
-            # Crear el mensaje embed para la cancin seleccionada
-            embed = discord.Embed(
-                title="Reproduciendo",
-                description=f"**{song_data['artist']}** - **{song_data['title']}**",
-                color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
-            )
-            # Agregar la miniatura al mensaje embed si hay una imagen de portada adjunta
-            if cover_file:
-                embed.set_thumbnail(url=f"attachment://{cover_file.filename}")
+    async def search_by_artist(self, artist_query):
+        return await self.search("artist", artist_query)
 
-            # Agregar el lbum al mensaje embed si est disponible
-            if "album" in song_data:
-                embed.add_field(name="lbum", value=song_data["album"], inline=True)
+    async def search_by_album(self, album_query):
+        return await self.search("album", album_query)
 
-            # Agregar el a?o al mensaje embed si est disponible
-            if "year" in song_data:
-                embed.add_field(name="A?o", value=song_data["year"], inline=True)
+    async def search_by_song(self, song_query):
+        return await self.search("title", song_query)
 
-            # Agregar la duracin al mensaje embed si est disponible
-            if "duration" in song_data:
-                embed.add_field(name="Duracin", value=song_data["duration"], inline=True)
-
-            # Agregar el bitrate al mensaje embed si est disponible
-            if "bitrate" in song_data:
-                embed.add_field(name="Bitrate", value=str(song_data["bitrate"]) + " kb/s", inline=True)
-
-            # Enviar el mensaje embed
-            await ctx.send(embed=embed)
-
-            # Cancelar el temporizador de desconexin
-            self.cancel_disconnect_timer()
-
-            # Esperar un momento despus de conectar antes de reproducir la cancin
-            await asyncio.sleep(0.5)
-
-            # Cargar el audio
-            audio_source = discord.FFmpegPCMAudio(filepath)
-
-            # Configurar el volumen del audio
-            if ctx.voice_client.source:
-                ctx.voice_client.source.volume = 0.5  # Establece el volumen en 0.5 (la mitad)
-
-            # Reproducir el audio
-            ctx.voice_client.play(audio_source, after=lambda e: self.bot.loop.call_soon_threadsafe(self.song_finished, ctx))
-
-        except Exception as e:
-            print(f"Error al reproducir la cancin seleccionada: {str(e)}")
-            await ctx.send("Ocurri un error al reproducir la cancin seleccionada.")
-
-    async def play_song(self, ctx):
-        try:
-            if not self.song_queue:
-                self.now_playing = None
-                return
-            song_data = self.song_queue.pop(0)
-            filepath = song_data["filepath"]
-            print(f"Ruta del archivo: {filepath}")  # Imprime la ruta del archivo
-            self.now_playing = song_data["title"]
-            print(f"Reproduciendo: {self.now_playing}")
-
-            # Obtener la imagen de la portada del archivo de audio
-            cover_path = song_data.get("cover_path")
-            
-
-            # Crear el objeto discord.File con la imagen de la portada
-            if cover_path:
-                cover_file = discord.File(cover_path, filename=os.path.basename(cover_path))
-            else:
-                cover_file = None
-                
-
-            # Crear el mensaje embed
-            embed = discord.Embed(
-                title="Reproduciendo",
-                description=f"**{song_data['artist']}** - **{self.now_playing}**",
-                color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
-            )
-
-            # Agregar la miniatura al mensaje embed si hay una imagen de portada adjunta
-            if cover_file:
-                embed.set_thumbnail(url=f"attachment://{cover_file.filename}")
-
-            # Agregar el lbum al mensaje embed si est disponible
-            if "album" in song_data:
-                embed.add_field(name="lbum", value=song_data["album"], inline=True)
-
-            # Agregar el a?o al mensaje embed si est disponible
-            if "year" in song_data:
-                embed.add_field(name="A?o", value=song_data["year"], inline=True)
-                   
-            
-            if "duration" in song_data:
-                embed.add_field(name="Duracin", value=song_data["duration"], inline=True)
-            
-            if "bitrate" in song_data:
-                embed.add_field(name="Bitrate", value=str(song_data["bitrate"]) + " kb/s", inline=True )
-
-            # Enviar el mensaje embed con la miniatura adjunta
-            await ctx.send(embed=embed, file=cover_file)
-
-            # Cancela el temporizador de desconexin
-            self.cancel_disconnect_timer()
-            
-            # Esperar un momento despus de conectar antes de reproducir la cancin
-            await asyncio.sleep(0.5)
-
-            # Cargar el audio
-            audio_source = discord.FFmpegPCMAudio(filepath)
-            
-            # Configurar el volumen del audio
-            if ctx.voice_client.source:
-                ctx.voice_client.source.volume = 0.5  # Establece el volumen en 0.5 (la mitad)
-            
-            # Reproducir el audio
-            ctx.voice_client.play(audio_source, after=lambda e: self.bot.loop.call_soon_threadsafe(self.song_finished, ctx))
-        
-        except Exception as e:
-            print(f"Error al reproducir la cancin: {str(e)}")
-            await ctx.send("Ocurri un error al reproducir la cancin.")
-
-    def song_finished(self, ctx):
-        # Verificar si hay ms canciones en la cola
-        if not self.song_queue:
-            # Si no hay ms canciones, reiniciar el temporizador
-            self.reset_disconnect_timer()
-        else:
-            # Si hay ms canciones en la cola, reproducir la siguiente
-            asyncio.run_coroutine_threadsafe(self.play_song(ctx), self.bot.loop)
-
-    @commands.command(brief="Pausa la reproduccin actual.", help="Pausa la reproduccin actual.")
+    @commands.command(brief="Pausa la reproducción actual.", help="Pausa la reproducción actual.")
     async def pause(self, ctx):
         try:
             if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
                 ctx.voice_client.pause()
-                await ctx.send("Reproduccin pausada.")
+                await ctx.send("Reproducción pausada.")
             else:
-                await ctx.send("No hay ninguna reproduccin en curso.")
+                await ctx.send("No hay ninguna reproducción en curso.")
         except AttributeError:
             await ctx.send("No estoy en un canal de voz... ??")
 
-    @commands.command(brief="Reanuda la reproduccin.", help="Reanuda la reproduccin.")
+    @commands.command(brief="Reanuda la reproducción.", help="Reanuda la reproducción.")
     async def resume(self, ctx):
         try:
             if ctx.voice_client.is_paused():
                 ctx.voice_client.resume()
             else:
-                await ctx.send("La reproduccin no est pausada.")
+                await ctx.send("La reproducción no está pausada.")
         except AttributeError:
             await ctx.send("No estoy en un canal de voz... ??")
 
-    @commands.command(brief="Salta la cancin actual.", help="Salta la cancin actual.\n\nAbreviaciones: !skip, !s, !S", aliases=["s", "S"] )
+    @commands.command(brief="Salta la canción actual.", help="Salta la canción actual.\n\nAbreviaciones: !skip, !s, !S", aliases=["s", "S"] )
     async def skip(self, ctx):
         try:
             if ctx.voice_client.is_playing():
-                ctx.voice_client.stop()
-                await self.play_song(ctx)
+                self.players.get(ctx.guild).skip()
             else:
-                await ctx.send("No hay ninguna reproduccin en curso para saltar.")
+                await ctx.send("No hay ninguna reproducción en curso para saltar.")
         except AttributeError:
             await ctx.send("No estoy en un canal de voz... ??")
 
-    @commands.command(brief="Detiene la reproduccin actual y limpia la cola.", help="Detiene la reproduccin actual y limpia la cola sin salir del canal de voz.")
+    @commands.command(brief="Detiene la reproducción actual y limpia la cola.", help="Detiene la reproducción actual y limpia la cola sin salir del canal de voz.")
     async def stop(self, ctx):
         try:
             if ctx.voice_client.is_playing() or ctx.voice_client.is_paused():
-                ctx.voice_client.stop()
-                self.song_queue.clear()  # Limpia la cola de reproduccin
-                self.cancel_disconnect_timer()  # Cancela cualquier temporizador de desconexin activo
-                await ctx.send("Reproduccin detenida y cola limpiada.")
+                self.players.get(ctx.guild).stop()
+                await ctx.send("Reproducción detenida y cola limpiada.")
             else:
-                await ctx.send("No hay ninguna reproduccin en curso para detener.")
+                await ctx.send("No hay ninguna reproducción en curso para detener.")
         except AttributeError:
             await ctx.send("No estoy en un canal de voz... ??")
-    def reset_disconnect_timer(self):
-        # Cancela el temporizador de desconexin si existe
-        self.cancel_disconnect_timer()
-        # Programa la desconexin despus de 3 minutos
-        self.disconnect_timer = self.bot.loop.create_task(self.disconnect_after_timeout())
-
-    def cancel_disconnect_timer(self):
-        if self.disconnect_timer:
-            self.disconnect_timer.cancel()
-
-    async def disconnect_after_timeout(self):
-        remaining_time = 180
-        while remaining_time > 0:
-            print(f"Tiempo restante para la desconexin automtica: {remaining_time} segundos")
-            await asyncio.sleep(10)  # Espera 10 segundos antes de verificar de nuevo
-            remaining_time -= 10
-
-        print("Bot desconectado por inactividad")
-        await self.bot.voice_clients[0].disconnect()
+
+    @commands.command(brief="Cambia el volumen.", help="Cambia el volumen de reproducción del servidor.\n\nUso: !volume [0-200]", aliases=["vol"])
+    async def volume(self, ctx, volume: int = None):
+        player = self.players.get(ctx.guild)
+        if volume is None:
+            await ctx.send(f"Volumen: **{player.volume}%**")
+            return
+        if not 0 <= volume <= MAX_VOLUME:
+            await ctx.send(f"El volumen debe estar entre 0 y {MAX_VOLUME}.")
+            return
+        try:
+            await player.set_volume(volume)
+        except AdmissionTimeout:
+            await ctx.send("El bot está reproduciendo en demasiados servidores a la vez. El volumen se aplicará en la siguiente canción.")
+            return
+        await ctx.send(f"Volumen: **{volume}%**")
+
+    @commands.command(brief="Muestra la cola de reproducción.", help="Muestra la cola de reproducción por páginas.\n\nUso: !queue [página]", aliases=["q", "Q"])
+    async def queue(self, ctx, page: int = 1):
+        player = self.players.find(ctx.guild.id)
+        if not player or (not player.song_queue and not player.now_playing and not player.up_next()):
+            await ctx.send("La cola está vacía.")
+            return
+        pages = max(1, -(-len(player.song_queue) // QUEUE_PAGE_SIZE))
+        page = min(max(page, 1), pages)
+        start = (page - 1) * QUEUE_PAGE_SIZE
+        lines = []
+        # Solo se buscan en la base de datos las canciones de la página mostrada
+        for position, track_id in enumerate(player.song_queue.page(start, QUEUE_PAGE_SIZE), start=start + 1):
+            song_data = await self.get_song(track_id)
+            lines.append(f"{position}. {song_data['artist']} - {song_data['title']}" if song_data else f"{position}. (ya no está en la base de datos)")
+        embed = discord.Embed(
+            title="Cola de Reproducción",
+            description="\n".join(lines) or "No hay más canciones en la cola.",
+            color=discord.Color.from_rgb(255, 255, 255)  # Color azul por defecto
+        )
+        if player.now_playing:
+            embed.add_field(name="Reproduciendo", value=player.now_playing, inline=False)
+        up_next = player.up_next()
+        if up_next:
+            embed.add_field(name="Siguiente", value=f"{up_next['artist']} - {up_next['title']}", inline=False)
+        embed.set_footer(text=f"Página {page}/{pages} · {len(player.song_queue)} canciones en cola")
+        await ctx.send(embed=embed)
+
+    @commands.command(brief="Mezcla la cola de reproducción.", help="Mezcla la cola de reproducción.")
+    async def shuffle(self, ctx):
+        player = self.players.find(ctx.guild.id)
+        if not player or not player.song_queue:
+            await ctx.send("La cola está vacía.")
+            return
+        player.song_queue.shuffle()
+        await ctx.send("Cola mezclada.")
+
+    @commands.command(brief="Quita una canción de la cola.", help="Quita una canción de la cola por su posición.\n\nUso: !remove <posición>", aliases=["rm"])
+    async def remove(self, ctx, position: int):
+        player = self.players.find(ctx.guild.id)
+        if not player or not 1 <= position <= len(player.song_queue):
+            await ctx.send("No hay ninguna canción en esa posición de la cola.")
+            return
+        song_data = await self.get_song(player.song_queue.remove(position - 1))
+        await ctx.send(f"Se quitó **{song_data['title'] if song_data else position}** de la cola.")
+
+    @commands.command(brief="Mueve una canción de la cola.", help="Mueve una canción de la cola a otra posición.\n\nUso: !move <posición> <nueva posición>", aliases=["mv"])
+    async def move(self, ctx, source: int, destination: int):
+        player = self.players.find(ctx.guild.id)
+        if not player or not 1 <= source <= len(player.song_queue) or not 1 <= destination <= len(player.song_queue):
+            await ctx.send("No hay ninguna canción en esa posición de la cola.")
+            return
+        song_data = await self.get_song(player.song_queue.move(source - 1, destination - 1))
+        await ctx.send(f"**{song_data['title'] if song_data else source}** ahora está en la posición {destination}.")
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member, before, after):
+        # Si echan al bot del canal de voz, su reproductor ya no sirve
+        if member.id == self.bot.user.id and before.channel and after.channel is None:
+            self.players.remove(member.guild.id)
+        self.players.reap()
 
 async def setup(client):
     await client.add_cog(Commands(client))
@@ -2,79 +2,277 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import asyncio
-import json
 import os
-from mutagen.flac import FLAC
+import time
 from decouple import config 
+from library.scanner import analyze_library, scan_library
+from library.storage import DATABASE_PATH, SqliteSongStore
+from library.watcher import start_watcher
+from logs import get_logger
+from metrics import counter, gauge, histogram
+
+
+PROGRESS_INTERVAL = 2  # Segundos mínimos entre actualizaciones de progreso
+LIVE_UPDATE_LIMIT = 1000  # Cambios a partir de los cuales se recarga la base entera
+
+log = get_logger(__name__)
+SCAN_DURATION = histogram("scan_seconds", "Duración de los escaneos de la biblioteca", ("trigger",),
+                          buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600))
+SCAN_FILES = counter("scan_files_total", "Archivos leídos por los escaneos", ("trigger",))
+SCAN_THROUGHPUT = gauge("scan_files_per_second", "Archivos leídos por segundo en el último escaneo", ("trigger",))
+
+
+async def run_scan(trigger, **kwargs):
+    # Escaneo con la configuración del .env; lo usan este cog y el coordinador del modo con varios procesos
+    start = time.perf_counter()
+    stats = await scan_library(
+        config("MUSIC_DIRECTORY"),
+        workers=config("SCAN_WORKERS", default=os.cpu_count(), cast=int),
+        backend=config("DATABASE_BACKEND", default="json"),
+        **kwargs)
+    elapsed = time.perf_counter() - start
+    files = stats["added"] + stats["updated"] + stats["failed"]
+    SCAN_DURATION.labels(trigger).observe(elapsed)
+    SCAN_FILES.labels(trigger).inc(files)
+    SCAN_THROUGHPUT.labels(trigger).set(files / elapsed if elapsed else 0)
+    log.info("biblioteca escaneada", trigger=trigger, songs=stats["total"], files=files,
+             added=stats["added"], updated=stats["updated"], removed=stats["removed"],
+             failed=stats["failed"], seconds=round(elapsed, 2))
+    return stats
+
+
+class LoudnessAnalysis:
+    # Medición en segundo plano de la sonoridad de las pistas sin ReplayGain, después de
+    # escribir el escaneo. Si se pide mientras ya está midiendo, vuelve a buscar canciones
+    # pendientes al terminar (las del escaneo que acaba de terminar)
+    def __init__(self, on_saved, library=None):
+        self.on_saved = on_saved  # corrutina(canciones) con cada tanda guardada
+        self.library = library  # Devuelve la base cargada en memoria
+        self.task = None
+        self.again = False
+
+    def request(self, scheduler=None):
+        if not config("ANALYZE_LOUDNESS", default=True, cast=bool):
+            return
+        if self.task and not self.task.done():
+            self.again = True
+            return
+        self.task = asyncio.create_task(self.run(scheduler))
+
+    async def run(self, scheduler):
+        self.again = True
+        while self.again:
+            self.again = False
+            start = time.perf_counter()
+            try:
+                total = await analyze_library(
+                    config("MUSIC_DIRECTORY"),
+                    backend=config("DATABASE_BACKEND", default="json"),
+                    workers=config("SCAN_WORKERS", default=os.cpu_count(), cast=int),
+                    scheduler=scheduler,
+                    on_saved=self.on_saved,
+                    library=self.library)
+            except Exception as e:
+                log.error("error al analizar la sonoridad", error=e)
+                return
+            if total:
+                log.info("sonoridad analizada", songs=total, seconds=round(time.perf_counter() - start, 2))
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+
+def watch_library(callback):
+    watcher = start_watcher(
+        config("MUSIC_DIRECTORY"),
+        callback,
+        delay=config("WATCH_DEBOUNCE", default=2.0, cast=float),
+        poll_interval=config("WATCH_POLL_INTERVAL", default=30.0, cast=float),
+        polling=config("WATCH_POLLING", default=False, cast=bool),
+    )
+    log.info("vigilando la biblioteca de música", watcher=type(watcher).__name__)
+    return watcher
+
+
+def scan_result(stats):
+    # Mensaje de confirmación
+    return (
+        "Base de datos generada correctamente.\n"
+        f"Canciones: **{stats['total']}** | Nuevas: **{stats['added']}** | "
+        f"Actualizadas: **{stats['updated']}** | Eliminadas: **{stats['removed']}**"
+        + (f" | Con errores: **{stats['failed']}**" if stats["failed"] else "")
+    )
 
 
 class slash_commands(commands.Cog):
     def __init__(self, client: commands.Bot):
         self.client = client   
+        self.scan_lock = asyncio.Lock()  # Solo un escaneo a la vez
+        self.watcher = None
+        # En el modo con varios procesos el coordinador escanea y vigila la biblioteca
+        self.cluster = getattr(client, "cluster", None)
+        self.progress = None  # Progreso del escaneo pedido al coordinador
+        self.loudness = LoudnessAnalysis(self.on_gains_saved, self.loaded_database)
+        self.loudness_startup = None
+
+    async def cog_load(self):
+        if not self.cluster:
+            if config("WATCH_LIBRARY", default=False, cast=bool):
+                self.start_watching()
+            # Canciones que quedaron sin medir (bases anteriores o un reinicio a mitad del análisis)
+            self.loudness_startup = asyncio.create_task(self.analyze_pending())
+
+    async def cog_unload(self):
+        self.stop_watching()
+        self.loudness.stop()
+
+    async def analyze_pending(self):
+        commands_cog = self.client.get_cog("Commands")
+        if commands_cog:
+            # Se espera a la carga inicial para que no pise las ganancias guardadas mientras tanto
+            await commands_cog.database_ready()
+        self.loudness.request(commands_cog.ffmpeg if commands_cog else None)
 
-    async def generate_database(self):
-        directory = config("MUSIC_DIRECTORY")
-        data_folder = "data"
-
-        if not os.path.exists(data_folder):
-            os.makedirs(data_folder)
-
-        song_database = []
-
-        for root, dirs, files in os.walk(directory):
-            for filename in files:
-                if filename.endswith(".flac"):
-                    filepath = os.path.join(root, filename)
-                    try:
-                        audio = FLAC(filepath)
-                        artist = audio["artist"][0] if "artist" in audio else "Desconocido"
-                        title = audio["title"][0] if "title" in audio else "Desconocido"
-                        duration_seconds = audio.info.length
-                        duration_formatted = "{:02}:{:02}".format(int(duration_seconds // 60), int(duration_seconds % 60))
-                        album = audio["album"][0] if "album" in audio else "Desconocido"
-                        year = audio["date"][0] if "date" in audio else "Desconocido"
-                        bitrate = audio.info.bitrate // 1000  # Convertir a kbps
-
-                        # Buscar la imagen de portada en la carpeta del álbum
-                        album_folder = os.path.dirname(filepath)
-                        cover_path = None
-                        for file in os.listdir(album_folder):
-                            if file.lower() in ["cover.jpg", "folder.jpg"]:
-                                cover_path = os.path.join(album_folder, file)
-                                break
-
-                        song_info = {
-                            "title": title,
-                            "artist": artist,
-                            "album": album,
-                            "duration": duration_formatted,
-                            "year": year,
-                            "bitrate": bitrate,
-                            "filename": filename,
-                            "filepath": os.path.normpath(filepath),
-                            "cover_path": os.path.normpath(cover_path) if cover_path else None
-                        }
-                        song_database.append(song_info)
-                    except Exception as e:
-                        print(f"Error al procesar el archivo {filepath}: {e}")
-
-        output_path = os.path.join(data_folder, "song_database.json")
-        with open(output_path, "w") as f:
-            json.dump(song_database, f, indent=4)
-
-        # Mensaje de confirmación
-        return "Base de datos generada correctamente."
+    def loaded_database(self):
+        # La base que tiene cargada el cog de comandos; el escáner toma de ella las canciones sin cambios
+        commands_cog = self.client.get_cog("Commands")
+        return commands_cog.store if commands_cog else None
+
+    async def on_gains_saved(self, songs):
+        commands_cog = self.client.get_cog("Commands")
+        if commands_cog and commands_cog.store:
+            await commands_cog.apply_gains(songs)
+
+    async def generate_database(self, full=False, progress=None):
+        if self.cluster:
+            self.progress = progress
+            try:
+                stats = await self.cluster.call("scan", full=full)
+            finally:
+                self.progress = None
+        else:
+            stats = await self.scan(full=full, progress=progress)
+        return scan_result(stats)
+
+    @commands.Cog.listener()
+    async def on_cluster_scan_progress(self, data):
+        if self.progress:
+            await self.progress(data["done"], data["total"])
+
+    async def scan(self, **kwargs):
+        commands_cog = self.client.get_cog("Commands")
+        trigger = "watcher" if "changed" in kwargs else "command"
+        stats = await run_scan(trigger, library=self.loaded_database, **kwargs)
+        # Se actualiza también la base cargada en el cog de comandos, sin tener que usar !rdb
+        if commands_cog:
+            await commands_cog.database_ready()
+        if commands_cog and commands_cog.store:
+            if len(stats["changed_songs"]) + len(stats["dropped_paths"]) > LIVE_UPDATE_LIMIT:
+                # Muchos cambios: es más rápido recargar todo fuera del event loop
+                await commands_cog.load_song_database()
+            else:
+                await commands_cog.apply_library_changes(stats["changed_songs"], stats["dropped_paths"])
+            # Opcionalmente se codifican ya en Opus las canciones nuevas o modificadas
+            commands_cog.prewarm(stats["changed_songs"])
+        if stats["changed_songs"]:
+            self.loudness.request(commands_cog.ffmpeg if commands_cog else None)
+        return stats
+
+    def start_watching(self):
+        if self.watcher:
+            return False
+        self.watcher = watch_library(self.on_library_changes)
+        return True
+
+    def stop_watching(self):
+        if not self.watcher:
+            return False
+        self.watcher.stop()
+        self.watcher = None
+        return True
+
+    async def on_library_changes(self, changed, deleted):
+        # `changed` es None cuando inotify perdió eventos y hay que revisar toda la biblioteca
+        try:
+            async with self.scan_lock:
+                await self.scan(changed=changed, deleted=deleted)
+        except Exception as e:
+            log.error("error al actualizar la biblioteca", error=e)
 
     @commands.Cog.listener()
     async def on_ready(self):
-        print("Comandos slash cargados correctamente.")
+        log.info("comandos slash cargados")
 
     @app_commands.command(name="gen_database", description="Generar archivo JSON")
-    async def generate_database_command(self, interaction: discord.Interaction):
-        # Crear una instancia de la clase para llamar al método
-        instance = slash_commands(self.client)
-        result = await instance.generate_database()
-        await interaction.response.send_message(result, ephemeral=True)
+    @app_commands.describe(completo="Volver a leer todos los archivos en lugar de solo los nuevos o modificados")
+    async def generate_database_command(self, interaction: discord.Interaction, completo: bool = False):
+        if self.scan_lock.locked():
+            await interaction.response.send_message("Ya hay un escaneo de la biblioteca en curso.", ephemeral=True)
+            return
+
+        # El escaneo puede tardar más que los 3 segundos que da Discord para responder
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        last_update = time.monotonic()
+
+        async def progress(done, total):
+            nonlocal last_update
+            # Limitar las ediciones del mensaje para no chocar con el rate limit
+            if time.monotonic() - last_update < PROGRESS_INTERVAL and done < total:
+                return
+            last_update = time.monotonic()
+            try:
+                await interaction.edit_original_response(content=f"Escaneando la biblioteca... {done}/{total} archivos leídos.")
+            except discord.HTTPException:
+                pass
+
+        async with self.scan_lock:
+            try:
+                result = await self.generate_database(full=completo, progress=progress)
+            except Exception as e:
+                log.error("error al generar la base de datos", error=e)
+                result = f"Error! no se pudo generar la base de datos.\n```{e}```"
+        await self.send_result(interaction, result)
+
+    @app_commands.command(name="watch_library", description="Actualizar la base de datos automáticamente al añadir música")
+    @app_commands.describe(activar="Activar o desactivar la vigilancia de la carpeta de música")
+    async def watch_library_command(self, interaction: discord.Interaction, activar: bool):
+        if self.cluster:
+            changed = await self.cluster.call("watch", active=activar)
+        elif activar:
+            changed = self.start_watching()
+        else:
+            changed = self.stop_watching()
+        if activar:
+            message = "Vigilando la carpeta de música." if changed else "La carpeta de música ya se estaba vigilando."
+        else:
+            message = "Se dejó de vigilar la carpeta de música." if changed else "La carpeta de música no se estaba vigilando."
+        await interaction.response.send_message(message, ephemeral=True)
+
+    @app_commands.command(name="export_database", description="Exportar la base de datos SQLite al archivo JSON")
+    async def export_database_command(self, interaction: discord.Interaction):
+        if config("DATABASE_BACKEND", default="json") != "sqlite":
+            await interaction.response.send_message("La base de datos ya se guarda en formato JSON.", ephemeral=True)
+            return
+        await interaction.response.defer(ephemeral=True, thinking=True)
+
+        def export():
+            store = SqliteSongStore()
+            try:
+                return store.export_json(DATABASE_PATH)
+            finally:
+                store.close()
+
+        total = await asyncio.to_thread(export)
+        await self.send_result(interaction, f"Se exportaron **{total}** canciones a `{DATABASE_PATH}`.")
+
+    async def send_result(self, interaction, content):
+        try:
+            await interaction.edit_original_response(content=content)
+        except discord.HTTPException:
+            # El token de la interacción caduca a los 15 minutos
+            if interaction.channel:
+                await interaction.channel.send(content)
 
 
 async def setup(client: commands.Bot) -> None:
@@ -0,0 +1,270 @@
+import asyncio
+import os
+import signal
+import sys
+import time
+import discord
+from decouple import config
+from audio.scheduler import FFmpegScheduler, default_background_limit, default_limit
+from cluster.ipc import DEFAULT_PORT, IPCServer
+from cogs.gen import LIVE_UPDATE_LIMIT, LoudnessAnalysis, run_scan, watch_library
+from library.prefix import PrefixIndex
+from library.storage import open_store
+from logs import get_logger, setup_logging
+from metrics import counter, gauge_callback, start_metrics_server
+
+# Modo con varios procesos: `python src/coordinator.py` en lugar de `python src/main.py`.
+# El coordinador tiene la base de datos, las búsquedas y el escaneo de la biblioteca, y
+# lanza varios procesos de audio (src/main.py), cada uno con una parte de los shards del
+# gateway. Discord asocia la voz de cada servidor a su shard, así que cada proceso
+# reproduce en los servidores de sus shards: la reproducción se reparte entre núcleos y
+# si un proceso falla solo se cortan sus servidores mientras el coordinador lo relanza.
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+IDENTIFY_INTERVAL = 5.0  # Discord permite un IDENTIFY cada 5 segundos por grupo
+MAX_RESTART_DELAY = 60  # Segundos máximos de espera antes de relanzar un proceso que falla
+STABLE_AFTER = 60  # Un proceso que duró más que esto se considera sano al fallar
+PROGRESS_EVENT_INTERVAL = 0.5  # Segundos mínimos entre eventos de progreso del escaneo
+
+log = get_logger("coordinator")
+WORKER_RESTARTS = counter("worker_restarts_total", "Procesos de audio relanzados tras terminar", ("worker",))
+
+
+class Worker:
+    # Un proceso de audio y los shards que tiene
+    def __init__(self, index, shard_ids):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.process = None
+        self.failures = 0
+
+
+class Coordinator:
+    def __init__(self):
+        self.port = config("CLUSTER_PORT", default=DEFAULT_PORT, cast=int)
+        self.metrics_port = config("METRICS_PORT", default=9108, cast=int)
+        self.store = None
+        self.store_total = 0
+        self.suggestions = PrefixIndex(())
+        self.reload_lock = asyncio.Lock()
+        self.scan_lock = asyncio.Lock()
+        self.watcher = None
+        # El coordinador no reproduce: su FFmpeg (el análisis de sonoridad) es todo trabajo en
+        # segundo plano, con el mismo límite que tiene ese trabajo en cada proceso de audio
+        background = (config("FFMPEG_BACKGROUND_PROCESSES", default=0, cast=int)
+                      or default_background_limit(config("FFMPEG_MAX_PROCESSES", default=default_limit(), cast=int)))
+        self.ffmpeg = FFmpegScheduler(background, background_limit=background)
+        self.loudness = LoudnessAnalysis(self.on_gains_saved, lambda: self.store)
+        self.workers = []
+        self.max_concurrency = 1
+        self.identify_locks = {}  # grupo de IDENTIFY -> lock
+        self.identified = {}  # grupo de IDENTIFY -> último turno concedido
+        self.stopping = False
+        self.server = IPCServer({
+            "hello": self.hello,
+            "identify": self.identify,
+            "get": self.get,
+            "search": self.search,
+            "suggest": self.suggest,
+            "reload": self.reload,
+            "scan": self.scan,
+            "watch": self.watch,
+        }, port=self.port)
+        gauge_callback("songs", "Canciones en la base de datos cargada", (), lambda: [((), self.store_total)])
+        gauge_callback("workers_connected", "Procesos de audio conectados al coordinador", (),
+                       lambda: [((), len(self.server.connections))])
+
+    # Base de datos
+
+    def open_song_database(self):
+        store = open_store(config("DATABASE_BACKEND", default="json")).load()
+        return store, store.count(), PrefixIndex(store.all_songs())
+
+    async def load_song_database(self):
+        async with self.reload_lock:
+            start = time.perf_counter()
+            store, total, suggestions = await asyncio.to_thread(self.open_song_database)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            previous, previous_total = self.store, self.store_total
+            self.store, self.store_total, self.suggestions = store, total, suggestions
+            if previous:
+                previous.close()
+        log.info("base de datos cargada", songs=total, elapsed_ms=round(elapsed_ms))
+        return {"total": total, "delta": total - previous_total, "elapsed_ms": elapsed_ms}
+
+    async def apply_library_changes(self, changed, removed):
+        async with self.reload_lock:
+            self.store.apply(changed, removed)
+            self.store_total = self.store.count()
+            self.suggestions = await asyncio.to_thread(lambda: PrefixIndex(self.store.all_songs()))
+
+    async def on_gains_saved(self, songs):
+        async with self.reload_lock:
+            self.store.replace(songs)
+
+    async def update_library(self, trigger, connection=None, **kwargs):
+        last_event = 0
+
+        async def progress(done, total):
+            nonlocal last_event
+            # El cog de quien pidió el escaneo limita a su vez las ediciones del mensaje
+            if connection and (time.monotonic() - last_event >= PROGRESS_EVENT_INTERVAL or done >= total):
+                last_event = time.monotonic()
+                connection.event("scan_progress", {"done": done, "total": total})
+
+        async with self.scan_lock:
+            stats = await run_scan(trigger, progress=progress, library=lambda: self.store, **kwargs)
+            if len(stats["changed_songs"]) + len(stats["dropped_paths"]) > LIVE_UPDATE_LIMIT:
+                await self.load_song_database()
+            else:
+                await self.apply_library_changes(stats["changed_songs"], stats["dropped_paths"])
+        # La caché de Opus la llenan los procesos de audio; basta con que la codifique uno
+        if (stats["changed_songs"] and self.server.connections
+                and config("OPUS_CACHE_PREWARM", default=False, cast=bool)):
+            next(iter(self.server.connections)).event("prewarm", stats["changed_songs"])
+        if stats["changed_songs"]:
+            self.loudness.request(self.ffmpeg)
+        return {key: stats[key] for key in ("total", "added", "updated", "removed", "failed")}
+
+    async def on_library_changes(self, changed, deleted):
+        try:
+            await self.update_library("watcher", changed=changed, deleted=deleted)
+        except Exception as e:
+            log.error("error al actualizar la biblioteca", error=e)
+
+    # Peticiones de los procesos de audio
+
+    async def hello(self, connection, worker, shard_ids):
+        connection.worker = worker
+        log.info("proceso de audio conectado", worker=worker, shards=",".join(map(str, shard_ids)))
+
+    async def identify(self, connection, shard_id):
+        # Turnos de IDENTIFY compartidos por todos los procesos (max_concurrency grupos)
+        bucket = shard_id % self.max_concurrency
+        async with self.identify_locks.setdefault(bucket, asyncio.Lock()):
+            wait = self.identified.get(bucket, -IDENTIFY_INTERVAL) + IDENTIFY_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.identified[bucket] = time.monotonic()
+
+    async def get(self, connection, track_id):
+        return self.store.get(track_id) if self.store else None
+
+    async def search(self, connection, field, query):
+        return await self.store.search_async(field, query) if self.store else []
+
+    async def suggest(self, connection, query):
+        return self.suggestions.suggest(query)
+
+    async def reload(self, connection):
+        return await self.load_song_database()
+
+    async def scan(self, connection, full=False):
+        if self.scan_lock.locked():
+            raise RuntimeError("Ya hay un escaneo de la biblioteca en curso.")
+        return await self.update_library("command", connection=connection, full=full)
+
+    async def watch(self, connection, active):
+        if active == bool(self.watcher):
+            return False
+        if active:
+            self.watcher = watch_library(self.on_library_changes)
+        else:
+            self.watcher.stop()
+            self.watcher = None
+        return True
+
+    # Procesos de audio
+
+    async def shard_plan(self):
+        # SHARD_COUNT=0 usa lo que recomienda Discord, pero al menos un shard por proceso
+        # para que la reproducción se reparta entre todos
+        processes = config("SHARD_PROCESSES", default=os.cpu_count(), cast=int)
+        shard_count = config("SHARD_COUNT", default=0, cast=int)
+        http = discord.http.HTTPClient(asyncio.get_running_loop())
+        try:
+            await http.static_login(config("TOKEN"))
+            recommended, _, limits = await http.get_bot_gateway()
+        finally:
+            await http.close()
+        self.max_concurrency = limits.get("max_concurrency", 1)
+        log.info("gateway", recommended_shards=recommended, max_concurrency=self.max_concurrency,
+                 session_starts_remaining=limits.get("remaining"))
+        shard_count = shard_count or max(recommended, processes)
+        processes = max(1, min(processes, shard_count))
+        return shard_count, [list(range(index, shard_count, processes)) for index in range(processes)]
+
+    async def supervise(self, worker, shard_count):
+        env = dict(os.environ,
+                   SHARD_IDS=",".join(map(str, worker.shard_ids)),
+                   SHARD_COUNT=str(shard_count),
+                   CLUSTER_WORKER=str(worker.index),
+                   CLUSTER_PORT=str(self.port),
+                   # Cada proceso expone sus métricas en su propio puerto, a continuación del coordinador
+                   METRICS_PORT=str(self.metrics_port + 1 + worker.index))
+        while not self.stopping:
+            started = time.monotonic()
+            worker.process = await asyncio.create_subprocess_exec(sys.executable, MAIN_PATH, env=env)
+            log.info("proceso de audio lanzado", worker=worker.index, pid=worker.process.pid,
+                     shards=env["SHARD_IDS"])
+            returncode = await worker.process.wait()
+            if self.stopping:
+                break
+            worker.failures = 0 if time.monotonic() - started > STABLE_AFTER else worker.failures + 1
+            delay = min(MAX_RESTART_DELAY, 2 ** worker.failures)
+            log.error("proceso de audio terminado, se relanzará", worker=worker.index,
+                      returncode=returncode, delay=delay)
+            WORKER_RESTARTS.labels(worker.index).inc()
+            await asyncio.sleep(delay)
+
+    async def stop_workers(self):
+        self.stopping = True
+        running = [worker.process for worker in self.workers if worker.process and worker.process.returncode is None]
+        for process in running:
+            process.terminate()
+        for process in running:
+            try:
+                await asyncio.wait_for(process.wait(), 10)
+            except asyncio.TimeoutError:
+                process.kill()
+
+    async def run(self):
+        metrics_server = await start_metrics_server()
+        # La base de datos se carga antes de lanzar los procesos: nunca la ven sin cargar
+        await self.load_song_database()
+        await self.server.start()
+        log.info("coordinador escuchando", port=self.port)
+        if config("WATCH_LIBRARY", default=False, cast=bool):
+            self.watcher = watch_library(self.on_library_changes)
+        # Canciones que quedaron sin medir (bases anteriores o un reinicio a mitad del análisis)
+        self.loudness.request(self.ffmpeg)
+
+        shard_count, plan = await self.shard_plan()
+        self.workers = [Worker(index, shard_ids) for index, shard_ids in enumerate(plan)]
+        log.info("lanzando procesos de audio", processes=len(self.workers), shards=shard_count)
+        tasks = [asyncio.create_task(self.supervise(worker, shard_count)) for worker in self.workers]
+
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows: Ctrl+C cancela run() y se cierra igual en el finally
+        try:
+            await stop.wait()
+        finally:
+            log.info("cerrando el coordinador")
+            await self.stop_workers()
+            self.loudness.stop()
+            for task in tasks:
+                task.cancel()
+            if self.watcher:
+                self.watcher.stop()
+            await self.server.close()
+            if metrics_server:
+                metrics_server.close()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(Coordinator().run())
@@ -0,0 +1,52 @@
+import hashlib
+import os
+
+COVERS_FOLDER = os.path.join("data", "covers")
+COVER_FILENAMES = ["cover.jpg", "folder.jpg"]
+FRONT_COVER = 3  # Tipo de imagen "Cover (front)" en los bloques PICTURE de FLAC
+EXTENSIONS = {"image/jpeg": "jpg", "image/jpg": "jpg", "image/png": "png", "image/gif": "gif", "image/webp": "webp"}
+
+
+def find_cover(album_folder):
+    # Buscar la imagen de portada en la carpeta del álbum
+    try:
+        files = os.listdir(album_folder)
+    except OSError:
+        return None
+    for file in files:
+        if file.lower() in COVER_FILENAMES:
+            return os.path.join(album_folder, file)
+    return None
+
+
+def store_embedded_cover(audio):
+    # Extrae la portada incrustada en el FLAC al almacén de portadas.
+    # El nombre es el hash del contenido, así una misma imagen se guarda una sola vez.
+    if not audio.pictures:
+        return None
+    picture = next((p for p in audio.pictures if p.type == FRONT_COVER), audio.pictures[0])
+    extension = EXTENSIONS.get(picture.mime.lower(), "jpg")
+    digest = hashlib.sha1(picture.data).hexdigest()
+    cover_path = os.path.join(COVERS_FOLDER, f"{digest}.{extension}")
+    if not os.path.exists(cover_path):
+        os.makedirs(COVERS_FOLDER, exist_ok=True)
+        # Varios procesos pueden extraer la misma imagen a la vez
+        tmp_path = f"{cover_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(picture.data)
+        os.replace(tmp_path, cover_path)
+    return cover_path
+
+
+def prune_covers(cover_paths):
+    # Borra del almacén las portadas que ya no usa ninguna canción
+    if not os.path.isdir(COVERS_FOLDER):
+        return 0
+    in_use = {os.path.basename(cover_path) for cover_path in cover_paths
+              if cover_path and os.path.dirname(cover_path) == os.path.normpath(COVERS_FOLDER)}
+    removed = 0
+    for file in os.listdir(COVERS_FOLDER):
+        if file not in in_use:
+            os.remove(os.path.join(COVERS_FOLDER, file))
+            removed += 1
+    return removed
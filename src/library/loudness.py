@@ -0,0 +1,84 @@
+import asyncio
+import math
+import re
+from audio.scheduler import BACKGROUND
+from logs import get_logger
+
+log = get_logger(__name__)
+
+REFERENCE_LUFS = -18.0  # Nivel de referencia de ReplayGain 2.0
+INTEGRATED = re.compile(r"I:\s+(-?[\d.]+) LUFS")
+PEAK = re.compile(r"Peak:\s+(-?[\d.]+|-inf) dBFS")
+
+
+def limit_gain(gain, peak):
+    # Nunca se sube tanto el volumen como para que el pico supere 0 dBFS
+    if peak and peak > 0:
+        gain = min(gain, -20 * math.log10(peak))
+    return round(gain, 2)
+
+
+def parse_db(value):
+    # "-7.89 dB" -> -7.89
+    return float(value.strip().split()[0])
+
+
+def gain_from_tags(audio):
+    # Etiquetas REPLAYGAIN_* escritas por el programa que ripeó o etiquetó el álbum
+    try:
+        gain = parse_db(audio["replaygain_track_gain"][0])
+    except (KeyError, IndexError, ValueError):
+        return None
+    try:
+        peak = float(audio["replaygain_track_peak"][0])
+    except (KeyError, IndexError, ValueError):
+        peak = None
+    return limit_gain(gain, peak)
+
+
+async def measure_gain(filepath):
+    # Mide la sonoridad integrada (EBU R128) decodificando el archivo completo con FFmpeg
+    process = await asyncio.create_subprocess_exec(
+        "ffmpeg", "-nostdin", "-hide_banner", "-nostats", "-i", filepath,
+        "-vn", "-af", "ebur128=framelog=quiet:peak=sample", "-f", "null", "-",
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()  # Al cerrar el bot se cancela el análisis en segundo plano
+        raise
+    output = stderr.decode(errors="replace")
+    loudness = INTEGRATED.findall(output)
+    if process.returncode != 0 or not loudness:
+        raise RuntimeError(output.strip().splitlines()[-1] if output.strip() else "ffmpeg falló")
+    peak = PEAK.findall(output)
+    if not peak or peak[-1] == "-inf":
+        return 0.0  # Pista en silencio: no se toca
+    # El resumen final es la última coincidencia
+    return limit_gain(REFERENCE_LUFS - float(loudness[-1]), 10 ** (float(peak[-1]) / 20))
+
+
+async def analyze_songs(songs, workers=1, scheduler=None, progress=None):
+    # Analiza en paralelo las canciones sin ganancia. Cada proceso de FFmpeg pasa por el
+    # planificador global como tarea en segundo plano, así nunca retrasa la reproducción.
+    semaphore = asyncio.Semaphore(max(1, workers))
+    done = 0
+
+    async def analyze(song_data):
+        nonlocal done
+        async with semaphore:
+            try:
+                if scheduler:
+                    async with await scheduler.acquire(BACKGROUND, timeout=float("inf")):
+                        song_data["gain"] = await measure_gain(song_data["filepath"])
+                else:
+                    song_data["gain"] = await measure_gain(song_data["filepath"])
+            except Exception as e:
+                # Se reproduce sin normalizar; no se reintenta en esta sesión salvo que cambie el archivo
+                song_data["gain"] = None
+                log.warning("error al analizar la sonoridad", path=song_data["filepath"], error=e)
+        done += 1
+        if progress:
+            await progress(done, len(songs))
+
+    await asyncio.gather(*(analyze(song_data) for song_data in songs))
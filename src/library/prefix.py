@@ -0,0 +1,87 @@
+from array import array
+from bisect import bisect_left
+from library.search import normalize
+
+MAX_CHOICES = 25  # Discord admite como máximo 25 sugerencias
+CHOICE_LENGTH = 100  # Longitud máxima del nombre y del valor de una sugerencia
+WORD_KEYS = 4  # También se puede empezar a escribir por las primeras palabras siguientes
+SCAN_LIMIT = 200  # Entradas distintas que se revisan como mucho por consulta
+ARTIST, ALBUM, TRACK = 0, 1, 2  # Orden en que se muestran las sugerencias
+
+
+def prefix_keys(value):
+    # "dont stop me now" -> "dont stop me now", "stop me now", "me now", "now"
+    keys = [value]
+    words = value.split()
+    for i in range(1, min(len(words), WORD_KEYS + 1)):
+        keys.append(" ".join(words[i:]))
+    return keys
+
+
+def group_value(kind, *names):
+    # Valor de una sugerencia de artista o álbum: los nombres normalizados
+    return (("artist:" if kind == ARTIST else "album:") + "\x1f".join(names))[:CHOICE_LENGTH]
+
+
+def shorten(text):
+    return text if len(text) <= CHOICE_LENGTH else text[:CHOICE_LENGTH - 1] + "…"
+
+
+class PrefixIndex:
+    # Índice de prefijos para el autocompletado de /play: todas las claves (título, artista
+    # y álbum normalizados, también desde sus primeras palabras) en una lista ordenada.
+    # Una consulta es una búsqueda binaria y un recorrido corto desde ahí.
+    def __init__(self, songs):
+        self.entries = []  # (tipo, nombre visible, valor)
+        keyed = []  # (clave, entrada * 2 + 1 si la clave empieza en una palabra intermedia)
+        groups = set()  # artistas y (artista, álbum) sin normalizar ya indexados
+        names = {}  # artistas y álbumes se repiten mucho: se normalizan una sola vez
+        for song in songs:
+            entry = self.add_entry(TRACK, f"{song['title']} — {song['artist']}", f"id:{song['id']}")
+            self.add_keys(keyed, normalize(song["title"]), entry)
+            raw_artist, raw_album = song["artist"], song["album"]
+            if (raw_artist, raw_album) in groups:
+                continue
+            groups.add((raw_artist, raw_album))
+            artist = names.get(raw_artist) or names.setdefault(raw_artist, normalize(raw_artist))
+            album = names.get(raw_album) or names.setdefault(raw_album, normalize(raw_album))
+            if raw_artist not in groups:
+                groups.add(raw_artist)
+                self.add_keys(keyed, artist, self.add_entry(ARTIST, f"Artista: {raw_artist}", group_value(ARTIST, artist)))
+            self.add_keys(keyed, album, self.add_entry(ALBUM, f"Álbum: {raw_album} — {raw_artist}", group_value(ALBUM, album, artist)))
+        keyed.sort()
+        self.keys = [key for key, _ in keyed]
+        self.refs = array("I", (ref for _, ref in keyed))
+
+    @staticmethod
+    def add_keys(keyed, value, entry):
+        keys = prefix_keys(value)
+        keyed.append((keys[0], entry * 2))
+        keyed.extend((key, entry * 2 + 1) for key in keys[1:])
+
+    def add_entry(self, kind, name, value):
+        self.entries.append((kind, shorten(name), value))
+        return len(self.entries) - 1
+
+    def __len__(self):
+        return len(self.keys)
+
+    def suggest(self, query, limit=MAX_CHOICES):
+        # Devuelve [(nombre, valor)]: primero artistas, luego álbumes y luego canciones
+        query = normalize(query).strip()
+        if not query:
+            return []
+        keys, refs = self.keys, self.refs
+        found = {}
+        i = bisect_left(keys, query)
+        while i < len(keys) and len(found) < SCAN_LIMIT and keys[i].startswith(query):
+            entry, inner_word = divmod(refs[i], 2)
+            rank = (inner_word, len(found))
+            if entry not in found or rank < found[entry]:
+                found[entry] = rank
+            i += 1
+        entries = self.entries
+        # Por tipo; dentro de cada tipo, antes lo que empieza por la consulta que lo que la
+        # tiene en otra palabra, y después por orden alfabético
+        best = sorted(found, key=lambda entry: (entries[entry][0], found[entry]))[:limit]
+        return [entries[entry][1:] for entry in best]
@@ -0,0 +1,27 @@
+import heapq
+from difflib import SequenceMatcher
+
+MAX_RESULTS = 25  # Discord admite como máximo 25 campos por embed
+
+
+def rank_by_similarity(songs, query, field="title", limit=MAX_RESULTS):
+    # Devuelve las `limit` canciones más parecidas a la consulta, de mayor a menor
+    # similitud (a igual puntuación se mantiene el orden original, como un sort estable).
+    # La puntuación no se guarda en las canciones: son registros compartidos.
+    matcher = SequenceMatcher(None)
+    # SequenceMatcher precalcula su tabla sobre la segunda secuencia: la consulta
+    # se fija una sola vez y solo cambia el título de cada candidata
+    matcher.set_seq2(query.lower())
+    best = []  # montículo de mínimos con (puntuación, -posición)
+    for position, song in enumerate(songs):
+        matcher.set_seq1(song[field].lower())
+        if len(best) == limit:
+            # Cotas superiores baratas: si ni siquiera así supera a la peor del top, se descarta
+            threshold = best[0][0]
+            if matcher.real_quick_ratio() <= threshold or matcher.quick_ratio() <= threshold:
+                continue
+            heapq.heappushpop(best, (matcher.ratio(), -position))
+        else:
+            heapq.heappush(best, (matcher.ratio(), -position))
+    best.sort(reverse=True)
+    return [songs[-position] for _, position in best]
@@ -0,0 +1,482 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from mutagen.flac import FLAC
+from library.covers import find_cover, prune_covers, store_embedded_cover
+from library.loudness import analyze_songs, gain_from_tags
+from library.storage import DATA_FOLDER, DATABASE_PATH, JsonSongStore, open_store, read_json, write_json
+from logs import get_logger
+
+MANIFEST_PATH = os.path.join(DATA_FOLDER, "library_manifest.json")
+MANIFEST_VERSION = 2
+BATCH_SIZE = 64  # Archivos por tarea enviada al pool de procesos
+GAIN_CHUNK_SIZE = 200  # Canciones analizadas por tanda (con SQLite, entre cada escritura)
+GAIN_WRITE_INTERVAL = 300  # Segundos mínimos entre cada reescritura del JSON con las ganancias medidas
+
+log = get_logger(__name__)
+
+
+class ScanState:
+    # Lo que el escáner sabe de la biblioteca entre un escaneo y el siguiente. Se guarda en
+    # memoria para que cada lote del watcher no vuelva a leer la biblioteca entera del disco.
+    # El manifiesto solo tiene la firma y el id de cada archivo; las canciones están en la base
+    # (con JSON, en la base que el bot ya tiene cargada: el escáner no guarda otra copia)
+    def __init__(self, directory, backend):
+        self.directory = directory
+        self.backend = backend
+        self.files = {}  # ruta -> [tamaño, mtime_ns, inodo, id]
+        self.next_id = 0
+        self.manifest_mtime = None  # Si otro proceso reescribe el manifiesto hay que releerlo
+        self.stale = False  # La base no coincide con el manifiesto: hay que recorrer todo el disco
+        self.unmeasurable = set()  # Rutas cuya sonoridad no se pudo medir (FFmpeg falló)
+
+    def key(self):
+        return self.directory, self.backend, os.path.abspath(MANIFEST_PATH)
+
+
+STATE = None
+STATE_LOCK = threading.Lock()  # El escaneo y el análisis de sonoridad escriben la base desde hilos
+
+
+def manifest_mtime():
+    try:
+        return os.stat(MANIFEST_PATH).st_mtime_ns
+    except OSError:
+        return None
+
+
+def loaded_json(library):
+    # `library` devuelve la base que el bot tiene cargada en memoria (o None)
+    database = library() if library else None
+    return database if isinstance(database, JsonSongStore) and database.index is not None else None
+
+
+def stored_songs(state, library, filepaths=None):
+    # Canciones de la base JSON (todas o las de `filepaths`, None si falta alguna). Se toman
+    # de la base ya cargada en memoria; si no está cargada o no coincide con el manifiesto
+    # (p. ej. se está recargando) se lee el archivo
+    database = loaded_json(library)
+    if database is not None:
+        if filepaths is None:
+            return database.all_songs()
+        songs = [database.get_path(filepath) for filepath in filepaths]
+        if None not in songs:
+            return songs
+    songs = read_json(DATABASE_PATH, [])
+    for song in songs:
+        if song["filepath"] in state.files:
+            song["id"] = state.files[song["filepath"]][3]
+    if filepaths is None:
+        return songs
+    by_path = {song["filepath"]: song for song in songs}
+    return [by_path.get(filepath) for filepath in filepaths]
+
+
+def load_state(directory, backend, library=None):
+    global STATE
+    if STATE and STATE.key() == (directory, backend, os.path.abspath(MANIFEST_PATH)) \
+            and STATE.manifest_mtime == manifest_mtime():
+        return STATE
+    state = ScanState(directory, backend)
+    manifest = read_json(MANIFEST_PATH, None)
+    # Si cambió el directorio de música o el formato, el manifiesto no sirve
+    if manifest and manifest.get("directory") == directory:
+        if manifest.get("version") == MANIFEST_VERSION:
+            state.files = manifest["files"]
+            state.next_id = manifest["next_id"]
+        elif manifest.get("version") == 1:
+            # Formato anterior: guardaba cada canción completa junto a su firma
+            for filepath, entry in manifest["files"].items():
+                if "id" in entry["song"]:
+                    state.files[filepath] = entry["signature"] + [entry["song"]["id"]]
+            state.next_id = manifest.get("next_id", 0)
+    store = open_store(backend)
+    try:
+        if backend == "json":
+            in_database = sum(1 for song in stored_songs(state, library, state.files) if song is not None)
+        else:
+            in_database = store.count()
+    finally:
+        store.close()
+    if in_database != len(state.files):
+        # La base no coincide con el manifiesto (p. ej. se cambió de backend o se borró):
+        # se vuelven a leer todos los archivos, conservando sus ids
+        state.files = {filepath: [None, None, None, entry[3]] for filepath, entry in state.files.items()}
+        state.stale = True
+    state.manifest_mtime = manifest_mtime()
+    STATE = state
+    return state
+
+
+def save_manifest(state):
+    write_json(MANIFEST_PATH, {"version": MANIFEST_VERSION, "directory": state.directory,
+                               "next_id": state.next_id, "files": state.files})
+    state.manifest_mtime = manifest_mtime()
+
+
+def file_signature(stat):
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+
+
+def walk_flac_files(directory):
+    # Igual que os.walk pero con scandir, así obtenemos el stat de cada archivo sin otra llamada
+    found = {}
+    pending = [directory]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = sorted(os.scandir(folder), key=lambda e: e.name)
+        except OSError as e:
+            log.warning("error al leer la carpeta", path=folder, error=e)
+            continue
+        subfolders = []
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=True):
+                subfolders.append(entry.path)
+            elif entry.name.endswith(".flac"):
+                try:
+                    found[os.path.normpath(entry.path)] = file_signature(entry.stat())
+                except OSError as e:
+                    log.warning("error al leer el archivo", path=entry.path, error=e)
+        pending.extend(reversed(subfolders))
+    return found
+
+
+def read_song_info(filepath, cover_path=None):
+    audio = FLAC(filepath)
+    artist = audio["artist"][0] if "artist" in audio else "Desconocido"
+    title = audio["title"][0] if "title" in audio else "Desconocido"
+    duration_seconds = audio.info.length
+    duration_formatted = "{:02}:{:02}".format(int(duration_seconds // 60), int(duration_seconds % 60))
+    album = audio["album"][0] if "album" in audio else "Desconocido"
+    year = audio["date"][0] if "date" in audio else "Desconocido"
+    bitrate = audio.info.bitrate // 1000  # Convertir a kbps
+
+    # Sin portada en la carpeta, usamos la imagen incrustada en el propio archivo
+    if cover_path is None:
+        cover_path = store_embedded_cover(audio)
+
+    return {
+        "title": title,
+        "artist": artist,
+        "album": album,
+        "duration": duration_formatted,
+        "year": year,
+        "bitrate": bitrate,
+        "filename": os.path.basename(filepath),
+        "filepath": os.path.normpath(filepath),
+        "cover_path": os.path.normpath(cover_path) if cover_path else None,
+        # MD5 del audio sin comprimir guardado en STREAMINFO: identifica el contenido del archivo
+        "audio_md5": "{:032x}".format(audio.info.md5_signature) if audio.info.md5_signature else None,
+        # Ganancia en dB para llegar al nivel de referencia; None si aún no se conoce
+        "gain": gain_from_tags(audio),
+    }
+
+
+def parse_batch(filepaths):
+    # Se ejecuta en un proceso del pool: devuelve (ruta, canción o None, error)
+    results = []
+    covers = {}  # Portada de cada carpeta, se busca una sola vez por álbum
+    for filepath in filepaths:
+        folder = os.path.dirname(filepath)
+        if folder not in covers:
+            covers[folder] = find_cover(folder)
+        try:
+            results.append((filepath, read_song_info(filepath, covers[folder]), None))
+        except Exception as e:
+            results.append((filepath, None, str(e)))
+    return results
+
+
+def make_batches(filepaths, batch_size=BATCH_SIZE):
+    # Agrupamos por carpeta para que cada álbum se procese en un solo proceso
+    by_folder = {}
+    for filepath in filepaths:
+        by_folder.setdefault(os.path.dirname(filepath), []).append(filepath)
+    batch = []
+    for folder_files in by_folder.values():
+        batch.extend(folder_files)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def plan_scan(directory, full, changed=None, deleted=(), backend="json", library=None):
+    os.makedirs(DATA_FOLDER, exist_ok=True)
+    with STATE_LOCK:
+        state = load_state(directory, backend, library)
+        known = {} if full else state.files
+        if changed is None or state.stale:
+            on_disk = walk_flac_files(directory)
+        else:
+            on_disk = apply_events(state, changed, deleted)
+    to_parse = [filepath for filepath, signature in on_disk.items()
+                if filepath not in known or known[filepath][:3] != signature]
+    return state, known, on_disk, to_parse
+
+
+def apply_events(state, changed, deleted):
+    # En lugar de recorrer toda la biblioteca, se parte del manifiesto y solo se
+    # consultan las rutas que avisó el watcher. Una ruta borrada puede ser una carpeta.
+    on_disk = {filepath: entry[:3] for filepath, entry in state.files.items()}
+    for path in deleted:
+        prefix = os.path.join(os.path.normpath(path), "")
+        for filepath in [f for f in on_disk if f == os.path.normpath(path) or f.startswith(prefix)]:
+            del on_disk[filepath]
+    for path in changed:
+        filepath = os.path.normpath(path)
+        try:
+            on_disk[filepath] = file_signature(os.stat(filepath))
+        except OSError:
+            on_disk.pop(filepath, None)
+    return on_disk
+
+
+def assign_id(state, filepath, song_info):
+    # Cada ruta conserva su id entre escaneos; las nuevas reciben el siguiente libre
+    previous = state.files.get(filepath)
+    if previous:
+        song_info["id"] = previous[3]
+    else:
+        song_info["id"] = state.next_id
+        state.next_id += 1
+
+
+def write_scan(state, known, on_disk, parsed, library=None):
+    # Se respeta el orden del recorrido del disco al escribir la base de datos
+    with STATE_LOCK:
+        files = {}
+        for filepath, signature in on_disk.items():
+            if filepath in parsed:
+                assign_id(state, filepath, parsed[filepath])
+                files[filepath] = signature + [parsed[filepath]["id"]]
+            elif filepath in known and known[filepath][:3] == signature:
+                files[filepath] = known[filepath]
+
+        removed = sum(1 for filepath in state.files if filepath not in on_disk)
+        added = sum(1 for filepath in parsed if filepath not in state.files)
+        dropped = [filepath for filepath in state.files if filepath not in files]
+
+        store = open_store(state.backend)
+        try:
+            songs = None
+            if state.backend == "json":
+                # JSON: el archivo se reescribe entero, con las canciones sin cambios de la base cargada
+                kept = [filepath for filepath in files if filepath not in parsed]
+                previous = {filepath: song for filepath, song in zip(kept, stored_songs(state, library, kept)) if song}
+                songs = [parsed.get(filepath) or previous[filepath] for filepath in files]
+                store.write(songs, changed=parsed.values(), removed=dropped)
+            else:
+                # SQLite: solo se tocan las filas nuevas, modificadas o borradas
+                store.write(None, changed=parsed.values(), removed=dropped)
+            state.files = files
+            state.stale = False
+            state.unmeasurable.difference_update(parsed)  # Se reintenta si el archivo cambió
+            save_manifest(state)
+            if parsed or dropped:
+                prune_covers([song["cover_path"] for song in songs] if songs is not None else store.cover_paths())
+        finally:
+            store.close()
+
+        return {
+            "total": len(files),
+            "added": added,
+            "updated": len(parsed) - added,
+            "removed": removed,
+            # Para actualizar la base que ya está cargada en memoria sin recargarla entera
+            "changed_songs": list(parsed.values()),
+            "dropped_paths": dropped,
+        }
+
+
+async def scan_library(directory, full=False, workers=None, progress=None, backend="json", changed=None, deleted=(),
+                       library=None):
+    # Escaneo incremental: solo se vuelven a leer los FLAC nuevos o modificados.
+    # Todo el trabajo pesado ocurre fuera del event loop: el recorrido y la escritura
+    # en un hilo, y la lectura de etiquetas repartida en un pool de procesos.
+    # Con `changed` (rutas avisadas por el watcher) no se recorre el directorio.
+    # La sonoridad de las pistas sin ReplayGain no se mide aquí sino después, con analyze_library().
+    # `library` devuelve la base JSON que ya está cargada, de donde se toman las canciones sin cambios.
+    loop = asyncio.get_running_loop()
+    state, known, on_disk, to_parse = await asyncio.to_thread(plan_scan, directory, full, changed, deleted, backend, library)
+
+    parsed = {}
+    errors = []
+
+    def collect(results):
+        for filepath, song_info, error in results:
+            if error is None:
+                parsed[filepath] = song_info
+            else:
+                log.warning("error al procesar el archivo", path=filepath, error=error)
+                errors.append(filepath)
+
+    if 0 < len(to_parse) <= BATCH_SIZE:
+        # Para pocos archivos no compensa arrancar el pool de procesos
+        collect(await asyncio.to_thread(parse_batch, to_parse))
+    elif to_parse:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            pending = [loop.run_in_executor(pool, parse_batch, batch) for batch in make_batches(to_parse)]
+            for future in asyncio.as_completed(pending):
+                collect(await future)
+                if progress:
+                    await progress(len(parsed) + len(errors), len(to_parse))
+        finally:
+            # Sin esperar en el event loop: si el escaneo se cancela o falla, los lotes que aún
+            # no empezaron se descartan y los procesos terminan por su cuenta
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    # Si el audio no cambió (mismo MD5, p. ej. solo se editaron las etiquetas o es un
+    # escaneo completo) se reutiliza la ganancia ya medida
+    previous = await asyncio.to_thread(previous_gains, state, parsed, library)
+    for song_data in parsed.values():
+        if song_data["gain"] is None:
+            song_data["gain"] = previous.get(song_data["audio_md5"])
+
+    stats = await asyncio.to_thread(write_scan, state, known, on_disk, parsed, library)
+    stats["failed"] = len(errors)
+    return stats
+
+
+def previous_gains(state, parsed, library=None):
+    # audio_md5 -> ganancia ya medida, para las canciones leídas en este escaneo
+    md5s = {song_data["audio_md5"] for song_data in parsed.values() if song_data.get("audio_md5")}
+    if not md5s:
+        return {}
+    if state.backend == "json":
+        return {song["audio_md5"]: song["gain"] for song in stored_songs(state, library)
+                if song.get("audio_md5") in md5s and song.get("gain") is not None}
+    store = open_store(state.backend)
+    try:
+        return store.gains(md5s)
+    finally:
+        store.close()
+
+
+def pending_gains(directory, backend, limit, cursor=None, library=None):
+    # Hasta `limit` canciones sin ganancia, con la firma que tenía el archivo al elegirlas.
+    # Cada llamada sigue donde terminó la anterior (`cursor`), así una pasada por la
+    # biblioteca solo la recorre una vez. Devuelve (canciones, cursor)
+    with STATE_LOCK:
+        state = load_state(directory, backend, library)
+        pending = []
+
+        def add(song):
+            entry = state.files.get(song["filepath"])
+            if entry and entry[0] is not None and song["filepath"] not in state.unmeasurable:
+                pending.append((dict(song), entry[:3]))
+
+        if backend == "json":
+            # Posición en la base cargada; si se recargó entretanto se empieza de nuevo
+            database = loaded_json(library)
+            if database is None:
+                return pending, cursor
+            songs = database.index.songs
+            position = cursor[1] if cursor and cursor[0] is database else 0
+            while position < len(songs) and len(pending) < limit:
+                song = songs[position]
+                position += 1
+                if song is not None and song.get("gain") is None:
+                    add(song)
+            return pending, (database, position)
+
+        # SQLite: último id consultado
+        store = open_store(backend)
+        try:
+            after = cursor if cursor is not None else -1
+            while len(pending) < limit:
+                rows = store.songs_without_gain(after, limit - len(pending))
+                if not rows:
+                    break
+                for song in rows:
+                    add(song)
+                after = rows[-1]["id"]
+            return pending, after
+        finally:
+            store.close()
+
+
+def save_gains(measured):
+    # Descarta las medidas de archivos que cambiaron mientras tanto. Con SQLite cada tanda se
+    # guarda ya; el JSON se reescribe entero, así que se escribe de vez en cuando con write_gains()
+    with STATE_LOCK:
+        state = STATE
+        saved = []
+        for song_data, signature in measured:
+            entry = state.files.get(song_data["filepath"])
+            if not entry or entry[:3] != signature:
+                continue
+            if song_data["gain"] is None:
+                # No se pudo medir: se reproduce sin normalizar y no se reintenta en esta sesión
+                state.unmeasurable.add(song_data["filepath"])
+                continue
+            saved.append(song_data)
+        if saved and state.backend != "json":
+            store = open_store(state.backend)
+            try:
+                store.write(None, changed=saved)
+            finally:
+                store.close()
+        return saved
+
+
+def write_gains(library):
+    # Reescribe el JSON con las ganancias que ya tiene la base cargada en memoria
+    with STATE_LOCK:
+        database = loaded_json(library)
+        if STATE is None or database is None:
+            return False
+        songs = [database.get_path(filepath) for filepath in STATE.files]
+        if None in songs:
+            # La base cargada aún no tiene el último escaneo: ese escaneo ya escribió el JSON
+            # desde ella, y las ganancias que falten se escribirán en la próxima ocasión
+            return False
+        JsonSongStore().write(songs)
+        return True
+
+
+async def analyze_library(directory, backend="json", workers=None, scheduler=None, on_saved=None, library=None):
+    # Mide en segundo plano la sonoridad de las canciones sin ganancia (sin ReplayGain o de
+    # bases anteriores a la normalización). Mientras tanto esas canciones suenan sin normalizar.
+    # `on_saved` recibe cada tanda medida para actualizar la base cargada en memoria, que
+    # devuelve `library`. Con SQLite se guarda cada tanda; el JSON, cada GAIN_WRITE_INTERVAL
+    # segundos y al terminar (un reinicio pierde como mucho ese intervalo).
+    workers = workers or os.cpu_count()
+    if backend == "json" and loaded_json(library) is None:
+        # Sin base cargada (p. ej. desde bench/) se carga una vez para todo el análisis
+        if not os.path.exists(DATABASE_PATH):
+            return 0
+        database = await asyncio.to_thread(lambda: JsonSongStore().load())
+        library, notify = (lambda: database), on_saved
+
+        async def on_saved(songs):
+            database.replace(songs)
+            if notify:
+                await notify(songs)
+
+    total = 0
+    cursor = None
+    unwritten = False
+    written_at = time.monotonic()
+    while True:
+        pending, cursor = await asyncio.to_thread(pending_gains, directory, backend, GAIN_CHUNK_SIZE, cursor, library)
+        if not pending:
+            break
+        await analyze_songs([song_data for song_data, _ in pending], workers, scheduler)
+        saved = await asyncio.to_thread(save_gains, pending)
+        total += len(saved)
+        log.info("sonoridad medida", songs=len(saved), total=total)
+        if saved and on_saved:
+            await on_saved(saved)
+        unwritten = unwritten or (backend == "json" and bool(saved))
+        if unwritten and time.monotonic() - written_at >= GAIN_WRITE_INTERVAL:
+            unwritten = not await asyncio.to_thread(write_gains, library)
+            written_at = time.monotonic()
+    if unwritten:
+        await asyncio.to_thread(write_gains, library)
+    return total
@@ -0,0 +1,90 @@
+import unicodedata
+from array import array
+
+APOSTROPHES = str.maketrans("", "", "'’‘`´")
+GRAM_SIZE = 3  # Tamaño de los n-gramas del índice invertido
+
+
+def normalize(text):
+    # Minúsculas (casefold), sin tildes ni apóstrofes: "Don’t Stop" -> "dont stop", "Café" -> "cafe"
+    text = str(text).casefold()
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return text.translate(APOSTROPHES)
+
+
+def grams(text):
+    return {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+class FieldIndex:
+    # Índice de un campo (título, artista o álbum). Muchas canciones comparten artista
+    # y álbum, así que se indexan los valores distintos y cada valor apunta a sus canciones.
+    def __init__(self):
+        self.values = []       # valor normalizado por id de valor
+        self.value_ids = {}    # valor normalizado -> id de valor
+        self.songs = []        # id de valor -> posiciones de las canciones con ese valor
+        self.postings = {}     # n-grama -> ids de valor que lo contienen
+
+    def add(self, value, position):
+        value = normalize(value)
+        value_id = self.value_ids.get(value)
+        if value_id is None:
+            value_id = len(self.values)
+            self.value_ids[value] = value_id
+            self.values.append(value)
+            self.songs.append(array("I"))
+            for gram in grams(value):
+                self.postings.setdefault(gram, array("I")).append(value_id)
+        self.songs[value_id].append(position)
+
+    def matching_values(self, query):
+        if len(query) < GRAM_SIZE:
+            # Consulta demasiado corta para el índice: se recorren los valores distintos
+            return [value_id for value_id, value in enumerate(self.values) if query in value]
+        # Basta con el n-grama menos frecuente para acotar candidatos; luego se verifica
+        # que la consulta completa aparezca en el valor
+        candidates = None
+        for gram in grams(query):
+            posting = self.postings.get(gram)
+            if posting is None:
+                return []
+            if candidates is None or len(posting) < len(candidates):
+                candidates = posting
+        values = self.values
+        return [value_id for value_id in candidates if query in values[value_id]]
+
+    def search(self, query):
+        positions = []
+        for value_id in self.matching_values(query):
+            positions.extend(self.songs[value_id])
+        positions.sort()
+        return positions
+
+
+class SearchIndex:
+    FIELDS = ("title", "artist", "album")
+
+    def __init__(self, songs):
+        self.songs = list(songs)
+        self.fields = {field: FieldIndex() for field in self.FIELDS}
+        for position, song in enumerate(self.songs):
+            for field, index in self.fields.items():
+                index.add(song[field], position)
+
+    def add(self, song):
+        position = len(self.songs)
+        self.songs.append(song)
+        for field, index in self.fields.items():
+            index.add(song[field], position)
+        return position
+
+    def remove(self, position):
+        # Las canciones borradas quedan como hueco hasta la próxima recarga completa
+        self.songs[position] = None
+
+    def search(self, field, query):
+        # Devuelve las canciones cuyo campo contiene la consulta, en el orden de la base de datos
+        songs = self.songs
+        return [songs[position] for position in self.fields[field].search(normalize(query))
+                if songs[position] is not None]
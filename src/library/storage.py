@@ -0,0 +1,253 @@
+import asyncio
+import json
+import os
+import sqlite3
+from library.search import SearchIndex, normalize
+
+DATA_FOLDER = "data"
+DATABASE_PATH = os.path.join(DATA_FOLDER, "song_database.json")
+SQLITE_PATH = os.path.join(DATA_FOLDER, "song_database.sqlite3")
+COLUMNS = ("id", "title", "artist", "album", "duration", "year", "bitrate", "filename", "filepath", "cover_path", "audio_md5", "gain")
+SEARCH_FIELDS = ("title", "artist", "album")
+
+
+def read_json(path, default):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def write_json(path, data, indent=None):
+    # Escritura atómica: nunca dejamos un archivo a medio escribir si el proceso muere
+    # (el nombre temporal lleva el pid: varios procesos pueden escribir el mismo archivo)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_path, path)
+
+
+class JsonSongStore:
+    # Formato original: toda la biblioteca en un JSON que se carga entera en memoria
+    def __init__(self, path=DATABASE_PATH):
+        self.path = path
+        self.by_id = {}
+        self.positions = {}  # ruta del archivo -> posición en el índice
+        self.index = None
+
+    def load(self):
+        with open(self.path, "r") as f:
+            songs = json.load(f)
+        # Las bases de datos antiguas no tienen id: se usa la posición
+        for position, song in enumerate(songs):
+            song.setdefault("id", position)
+        self.by_id = {song["id"]: song for song in songs}
+        self.positions = {song["filepath"]: position for position, song in enumerate(songs)}
+        self.index = SearchIndex(songs)
+        return self
+
+    def apply(self, changed, removed):
+        # Cambios incrementales del watcher sobre la base ya cargada, sin releer el JSON
+        for filepath in list(removed) + [song["filepath"] for song in changed]:
+            position = self.positions.pop(filepath, None)
+            if position is not None:
+                self.by_id.pop(self.index.songs[position]["id"], None)
+                self.index.remove(position)
+        for song in changed:
+            self.positions[song["filepath"]] = self.index.add(song)
+            self.by_id[song["id"]] = song
+
+    def replace(self, songs):
+        # Canciones que solo cambiaron fuera de los campos de búsqueda (p. ej. la ganancia):
+        # se sustituyen en su posición, sin tocar los índices ni el orden de la base
+        for song in songs:
+            position = self.positions.get(song["filepath"])
+            if position is not None:
+                self.index.songs[position] = song
+                self.by_id[song["id"]] = song
+
+    def count(self):
+        return len(self.by_id)
+
+    def get_path(self, filepath):
+        position = self.positions.get(filepath)
+        return self.index.songs[position] if position is not None else None
+
+    def get(self, track_id):
+        return self.by_id.get(track_id)
+
+    def all_songs(self):
+        # Copia de una sola vez: la base puede cambiar mientras se recorre desde otro hilo
+        return list(self.by_id.values())
+
+    def search(self, field, query):
+        return self.index.search(field, query)
+
+    async def search_async(self, field, query):
+        # En memoria: es rápida, se hace en el event loop
+        return self.search(field, query)
+
+    def write(self, songs, changed=(), removed=()):
+        # El JSON siempre se reescribe completo
+        write_json(self.path, songs, indent=4)
+
+    def close(self):
+        pass
+
+
+class SqliteSongStore:
+    # Biblioteca en SQLite con un índice de texto completo (FTS5 con trigramas) sobre los
+    # campos normalizados. Las canciones se leen bajo demanda, no se guardan en memoria.
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.searches = 0  # Búsquedas en curso en otros hilos (solo se cuenta desde el event loop)
+        self.closing = False
+        self.create_schema()
+
+    def create_schema(self):
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS songs (
+                    id INTEGER PRIMARY KEY,
+                    title TEXT, artist TEXT, album TEXT, duration TEXT, year TEXT,
+                    bitrate INTEGER, filename TEXT, filepath TEXT UNIQUE, cover_path TEXT
+                )""")
+            # Bases creadas con versiones anteriores: se añaden las columnas nuevas
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(songs)")}
+            for column in COLUMNS:
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE songs ADD COLUMN {column}")
+            self.connection.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS songs_fts
+                USING fts5(title, artist, album, tokenize='trigram')""")
+
+    def apply(self, changed, removed):
+        # Los cambios ya los escribió el escáner en la base; esta conexión los ve directamente
+        pass
+
+    def replace(self, songs):
+        pass
+
+    def load(self):
+        # Migración desde el formato JSON la primera vez que se usa SQLite
+        if self.count() == 0 and os.path.exists(DATABASE_PATH):
+            self.import_json(DATABASE_PATH)
+        return self
+
+    def count(self):
+        return self.connection.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def get(self, track_id):
+        row = self.connection.execute("SELECT * FROM songs WHERE id = ?", (track_id,)).fetchone()
+        return dict(row) if row else None
+
+    def all_songs(self):
+        return [dict(row) for row in self.connection.execute("SELECT id, title, artist, album FROM songs")]
+
+    def search(self, field, query):
+        if field not in SEARCH_FIELDS:
+            raise ValueError(f"Campo de búsqueda no válido: {field}")
+        query = normalize(query)
+        if len(query) < 3:
+            # El tokenizador de trigramas no sirve para consultas tan cortas
+            rows = self.connection.execute(
+                f"SELECT s.* FROM songs_fts f JOIN songs s ON s.id = f.rowid "
+                f"WHERE instr(f.{field}, ?) > 0 ORDER BY s.filepath", (query,))
+        else:
+            phrase = '"' + query.replace('"', '""') + '"'
+            rows = self.connection.execute(
+                "SELECT s.* FROM songs_fts f JOIN songs s ON s.id = f.rowid "
+                "WHERE songs_fts MATCH ? ORDER BY s.filepath", (f"{field} : {phrase}",))
+        return [dict(row) for row in rows]
+
+    def write(self, songs, changed=(), removed=()):
+        # Todo en una transacción: o se aplica el escaneo completo o nada
+        with self.connection:
+            self.delete(removed)
+            self.upsert(changed)
+            # Si la base no coincide con la lista completa (p. ej. al importar un JSON) se reescribe entera
+            if songs is not None and self.count() != len(songs):
+                self.connection.execute("DELETE FROM songs")
+                self.connection.execute("DELETE FROM songs_fts")
+                self.upsert(songs)
+
+    def gains(self, md5s):
+        # audio_md5 -> ganancia ya medida
+        md5s = list(md5s)
+        gains = {}
+        for start in range(0, len(md5s), 500):
+            chunk = md5s[start:start + 500]
+            gains.update(self.connection.execute(
+                f"SELECT audio_md5, gain FROM songs WHERE gain IS NOT NULL AND audio_md5 IN ({', '.join('?' for _ in chunk)})",
+                chunk).fetchall())
+        return gains
+
+    def songs_without_gain(self, after=-1, limit=500):
+        # Por tandas en orden de id: cada consulta sigue donde terminó la anterior
+        return [dict(row) for row in self.connection.execute(
+            "SELECT * FROM songs WHERE gain IS NULL AND id > ? ORDER BY id LIMIT ?", (after, limit))]
+
+    def cover_paths(self):
+        return [row[0] for row in self.connection.execute("SELECT DISTINCT cover_path FROM songs")]
+
+    def delete(self, filepaths):
+        for filepath in filepaths:
+            row = self.connection.execute("SELECT id FROM songs WHERE filepath = ?", (filepath,)).fetchone()
+            if row:
+                self.connection.execute("DELETE FROM songs WHERE id = ?", (row[0],))
+                self.connection.execute("DELETE FROM songs_fts WHERE rowid = ?", (row[0],))
+
+    def upsert(self, songs):
+        for song in songs:
+            # Por si la misma ruta tenía otro id (p. ej. tras importar un JSON antiguo)
+            self.delete((song["filepath"],))
+            self.connection.execute(
+                f"INSERT OR REPLACE INTO songs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                tuple(song.get(column) for column in COLUMNS))
+            self.connection.execute("DELETE FROM songs_fts WHERE rowid = ?", (song["id"],))
+            # En el índice de texto se guardan los campos normalizados (sin tildes ni apóstrofes)
+            self.connection.execute(
+                "INSERT INTO songs_fts (rowid, title, artist, album) VALUES (?, ?, ?, ?)",
+                (song["id"], normalize(song["title"]), normalize(song["artist"]), normalize(song["album"])))
+
+    def import_json(self, path):
+        songs = read_json(path, [])
+        for position, song in enumerate(songs):
+            song.setdefault("id", position)
+        self.write(songs)
+
+    def export_json(self, path=DATABASE_PATH):
+        songs = [dict(row) for row in self.connection.execute("SELECT * FROM songs ORDER BY filepath")]
+        write_json(path, songs, indent=4)
+        return len(songs)
+
+    async def search_async(self, field, query):
+        # Las consultas (sobre todo las cortas, que recorren la tabla) se hacen en un hilo para
+        # no bloquear el event loop. Si la base se cierra entretanto, se cierra al terminar
+        self.searches += 1
+        try:
+            return await asyncio.to_thread(self.search, field, query)
+        finally:
+            self.searches -= 1
+            if self.closing and not self.searches:
+                self.connection.close()
+
+    def close(self):
+        # Al recargar, la base anterior puede tener búsquedas en curso: se cierra al terminar la última
+        self.closing = True
+        if not self.searches:
+            self.connection.close()
+
+
+BACKENDS = {"json": JsonSongStore, "sqlite": SqliteSongStore}
+
+
+def open_store(backend="json"):
+    try:
+        return BACKENDS[backend]()
+    except KeyError:
+        raise ValueError(f"Backend de base de datos desconocido: {backend}") from None
@@ -0,0 +1,205 @@
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import struct
+import sys
+from library.scanner import walk_flac_files
+from logs import get_logger
+
+log = get_logger(__name__)
+
+# Constantes de inotify (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class ChangeBatcher:
+    # Agrupa los avisos del sistema de archivos: espera a que pasen `delay` segundos sin
+    # cambios (copiar un álbum genera muchos eventos seguidos) y los entrega de una vez.
+    # `max_delay` evita esperar para siempre mientras se copia una biblioteca enorme.
+    def __init__(self, callback, delay=2.0, max_delay=30.0):
+        self.callback = callback
+        self.delay = delay
+        self.max_delay = max_delay
+        self.changed = set()
+        self.deleted = set()
+        self.full_rescan = False
+        self.first_event = None
+        self.handle = None
+        self.task = None
+
+    def add(self, changed=(), deleted=(), full_rescan=False):
+        for path in deleted:
+            self.changed.discard(path)
+            self.deleted.add(path)
+        for path in changed:
+            self.deleted.discard(path)
+            self.changed.add(path)
+        self.full_rescan = self.full_rescan or full_rescan
+        loop = asyncio.get_running_loop()
+        if self.first_event is None:
+            self.first_event = loop.time()
+        if self.handle:
+            self.handle.cancel()
+        wait = min(self.delay, max(0.0, self.first_event + self.max_delay - loop.time()))
+        self.handle = loop.call_later(wait, self.flush)
+
+    def flush(self):
+        if self.task and not self.task.done():
+            # Todavía se está aplicando el lote anterior: se reintenta después
+            self.handle = asyncio.get_running_loop().call_later(self.delay, self.flush)
+            return
+        changed = None if self.full_rescan else sorted(self.changed)
+        deleted = sorted(self.deleted)
+        self.changed, self.deleted, self.full_rescan = set(), set(), False
+        self.first_event = self.handle = None
+        self.task = asyncio.get_running_loop().create_task(self.callback(changed, deleted))
+
+    def cancel(self):
+        if self.handle:
+            self.handle.cancel()
+        self.handle = None
+
+
+class InotifyWatcher:
+    # Vigila la biblioteca con inotify: coste nulo mientras no cambie nada
+    def __init__(self, directory, batcher):
+        self.directory = directory
+        self.batcher = batcher
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self.folders = {}  # descriptor de vigilancia -> carpeta
+
+    def start(self):
+        try:
+            self.watch_tree(self.directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+        asyncio.get_running_loop().add_reader(self.fd, self.read_events)
+
+    def watch_tree(self, folder):
+        # Devuelve los FLAC que ya existían (p. ej. al mover un álbum completo dentro)
+        found = []
+        for root, dirs, files in os.walk(folder):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                # ENOSPC: se alcanzó fs.inotify.max_user_watches
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch {root}")
+            self.folders[wd] = root
+            found.extend(os.path.join(root, f) for f in files if f.endswith(".flac"))
+        return found
+
+    def unwatch_tree(self, folder):
+        prefix = os.path.join(folder, "")
+        for wd, path in list(self.folders.items()):
+            if path == folder or path.startswith(prefix):
+                self.libc.inotify_rm_watch(self.fd, wd)
+                del self.folders[wd]
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        changed, deleted, full_rescan = [], [], False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+            offset += EVENT_HEADER.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                # Se perdieron eventos: solo queda revisar todo
+                full_rescan = True
+                continue
+            if mask & IN_IGNORED:
+                self.folders.pop(wd, None)
+                continue
+            folder = self.folders.get(wd)
+            if folder is None or not name:
+                continue
+            path = os.path.join(folder, os.fsdecode(name))
+
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        changed.extend(self.watch_tree(path))
+                    except OSError as e:
+                        log.warning("no se pudo vigilar la carpeta", path=path, error=e)
+                        full_rescan = True
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.unwatch_tree(path)
+                    deleted.append(path)
+            elif path.endswith(".flac"):
+                if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed.append(path)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    deleted.append(path)
+
+        if changed or deleted or full_rescan:
+            self.batcher.add(changed, deleted, full_rescan)
+
+    def stop(self):
+        self.batcher.cancel()
+        asyncio.get_running_loop().remove_reader(self.fd)
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    # Alternativa sin inotify: compara tamaño/mtime/inodo de todos los FLAC cada `interval` segundos
+    def __init__(self, directory, batcher, interval=30.0):
+        self.directory = directory
+        self.batcher = batcher
+        self.interval = interval
+        self.snapshot = None
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.get_running_loop().create_task(self.poll())
+
+    async def poll(self):
+        self.snapshot = await asyncio.to_thread(walk_flac_files, self.directory)
+        while True:
+            await asyncio.sleep(self.interval)
+            current = await asyncio.to_thread(walk_flac_files, self.directory)
+            changed = [path for path, signature in current.items() if self.snapshot.get(path) != signature]
+            deleted = [path for path in self.snapshot if path not in current]
+            self.snapshot = current
+            if changed or deleted:
+                self.batcher.add(changed, deleted)
+
+    def stop(self):
+        self.batcher.cancel()
+        if self.task:
+            self.task.cancel()
+
+
+def start_watcher(directory, callback, delay=2.0, poll_interval=30.0, polling=False):
+    # Usa inotify si está disponible (Linux) y si no, o si falla, revisa periódicamente
+    batcher = ChangeBatcher(callback, delay)
+    watcher = None
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            watcher = InotifyWatcher(directory, batcher)
+            watcher.start()
+        except (OSError, AttributeError) as e:
+            log.warning("inotify no disponible, se revisará la biblioteca periódicamente", error=e, interval=poll_interval)
+            watcher = None
+    if watcher is None:
+        watcher = PollingWatcher(directory, batcher, poll_interval)
+        watcher.start()
+    return watcher
@@ -0,0 +1,57 @@
+import logging
+import sys
+import time
+from decouple import config
+
+RESERVED = set(vars(logging.makeLogRecord({})))  # Atributos propios de un LogRecord
+
+
+def quote(value):
+    text = str(value)
+    if not text or any(c in text for c in ' "=\n'):
+        text = '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    return text
+
+
+class LogfmtFormatter(logging.Formatter):
+    # Una línea por evento en formato clave=valor (logfmt), fácil de filtrar con grep o de
+    # enviar a Loki/Elasticsearch: ts=... level=info logger=audio.player event=... guild=...
+    def __init__(self, worker=None):
+        super().__init__()
+        self.worker = worker  # Proceso de audio que escribe la línea (modo con varios procesos)
+
+    def format(self, record):
+        fields = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "worker": self.worker,
+            "event": record.getMessage(),
+        }
+        fields.update((key, value) for key, value in vars(record).items() if key not in RESERVED)
+        line = " ".join(f"{key}={quote(value)}" for key, value in fields.items() if value is not None)
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    # log.info("reproduciendo", guild=..., title=...): los argumentos con nombre son campos
+    def process(self, msg, kwargs):
+        extra = {key: kwargs.pop(key) for key in list(kwargs) if key not in ("exc_info", "stack_info", "stacklevel")}
+        kwargs["extra"] = extra
+        return msg, kwargs
+
+
+def get_logger(name):
+    return StructuredLogger(logging.getLogger(name), {})
+
+
+def setup_logging():
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(LogfmtFormatter(config("CLUSTER_WORKER", default=None)))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(config("LOG_LEVEL", default="INFO").upper())
+    # discord.py registra mucho a nivel INFO (gateway, voz)
+    logging.getLogger("discord").setLevel(config("DISCORD_LOG_LEVEL", default="WARNING").upper())
@@ -1,27 +1,120 @@
+import time
+PROCESS_START = time.perf_counter()  # Referencia para los tiempos de arranque
+
 import discord
 from discord.ext import commands
 import os
 import asyncio
+import hashlib
+import json
 from decouple import config
 from typing import Literal
+from cluster.ipc import DEFAULT_PORT, IPCClient
+from library.storage import DATA_FOLDER, read_json, write_json
+from logs import get_logger, setup_logging
+from metrics import gauge, histogram, start_metrics_server
+
+COMMAND_TREE_PATH = os.path.join(DATA_FOLDER, "command_tree.json")
+# Solo en los procesos de audio que lanza src/coordinator.py: los shards de este proceso
+SHARD_IDS = [int(shard_id) for shard_id in config("SHARD_IDS", default="").split(",") if shard_id]
+
+log = get_logger("main")
+
+# Desde que el usuario envía el comando hasta que el bot termina de atenderlo
+COMMAND_LATENCY = histogram("command_latency_seconds", "Latencia de los comandos", ("command", "kind"))
+STARTUP = gauge("startup_phase_seconds", "Segundos desde el arranque del proceso hasta cada fase", ("phase",))
 
 # Clase principal del Bot de Música
-class Client(commands.Bot):
+class Client(commands.AutoShardedBot if SHARD_IDS else commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix="!", intents=discord.Intents.all())
+        shards = {"shard_ids": SHARD_IDS, "shard_count": config("SHARD_COUNT", cast=int)} if SHARD_IDS else {}
+        super().__init__(command_prefix="!", intents=discord.Intents.all(), **shards)
         self.cogslist = ["commands", "gen"]
+        self.startup = {}  # fase -> segundos desde el arranque del proceso
+        self.cluster = None  # Conexión con el coordinador (modo con varios procesos)
+
+    def mark(self, phase):
+        # Registra una fase del arranque (solo la primera vez)
+        if phase in self.startup:
+            return
+        self.startup[phase] = elapsed = time.perf_counter() - PROCESS_START
+        STARTUP.labels(phase).set(elapsed)
+        log.info("arranque", phase=phase, seconds=round(elapsed, 3))
+        # Se puede reproducir cuando hay conexión con Discord y la base de datos está cargada
+        if phase != "playable" and "ready" in self.startup and "database" in self.startup:
+            self.mark("playable")
 
     async def on_ready(self):
-        print(f"El bot {self.user.name} se ha conectado correctamente.")
-        try:
-            synced = await self.tree.sync()
-            print(f"Synced {len(synced)} command(s)")
-        except Exception as e:
-            print(e)
+        # También se llama tras cada reconexión: aquí no se hace nada costoso
+        log.info("bot conectado", user=self.user.name)
+        self.mark("ready")
     
     async def setup_hook(self):
+        self.mark("login")
+        self.metrics_server = await start_metrics_server()
+        if SHARD_IDS:
+            # Antes de cargar los cogs: usan el coordinador para la base de datos
+            self.cluster = await IPCClient(port=config("CLUSTER_PORT", default=DEFAULT_PORT, cast=int),
+                                           on_event=self.cluster_event, on_lost=self.cluster_lost).connect()
+            await self.cluster.call("hello", worker=config("CLUSTER_WORKER", default=0, cast=int), shard_ids=SHARD_IDS)
         for ext in self.cogslist:
             await self.load_extension(f"cogs.{ext}")
+        self.mark("cogs")
+        await self.sync_tree()
+        self.mark("tree")
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        # Los procesos de audio comparten el límite de IDENTIFY de Discord: el coordinador da los turnos
+        if self.cluster:
+            await self.cluster.call("identify", shard_id=shard_id)
+        else:
+            await super().before_identify_hook(shard_id, initial=initial)
+
+    async def cluster_event(self, name, data):
+        # Eventos del coordinador como eventos del bot: on_cluster_<nombre>
+        self.dispatch(f"cluster_{name}", data)
+
+    def cluster_lost(self):
+        # Sin coordinador no hay base de datos; el coordinador vuelve a lanzar el proceso
+        log.error("sin coordinador, cerrando el proceso")
+        asyncio.create_task(self.close())
+
+    async def close(self):
+        if self.cluster:
+            await self.cluster.close()
+        await super().close()
+
+    def tree_hash(self):
+        commands = sorted((command.to_dict(self.tree) for command in self.tree.get_commands()),
+                          key=lambda command: (command.get("type", 1), command["name"]))
+        return hashlib.sha256(json.dumps(commands, sort_keys=True).encode()).hexdigest()
+
+    async def sync_tree(self):
+        # Sincronizar en cada arranque gasta rate limit y no hace falta si los comandos no cambiaron
+        if SHARD_IDS and 0 not in SHARD_IDS:
+            return  # Los comandos son globales: los sincroniza solo el proceso del shard 0
+        current = self.tree_hash()
+        synced = read_json(COMMAND_TREE_PATH, {})
+        if (synced.get("hash") == current and synced.get("application_id") == self.application_id
+                and not config("FORCE_COMMAND_SYNC", default=False, cast=bool)):
+            log.info("comandos sin cambios, no se sincronizan")
+            return
+        try:
+            result = await self.tree.sync()
+        except Exception as e:
+            log.error("error al sincronizar los comandos", error=e)
+            return
+        os.makedirs(DATA_FOLDER, exist_ok=True)
+        await asyncio.to_thread(write_json, COMMAND_TREE_PATH, {"application_id": self.application_id, "hash": current})
+        log.info("comandos sincronizados", count=len(result))
+
+    async def on_command_completion(self, ctx):
+        COMMAND_LATENCY.labels(ctx.command.qualified_name, "prefix").observe(
+            (discord.utils.utcnow() - ctx.message.created_at).total_seconds())
+
+    async def on_app_command_completion(self, interaction, command):
+        COMMAND_LATENCY.labels(command.qualified_name, "slash").observe(
+            (discord.utils.utcnow() - interaction.created_at).total_seconds())
 
 client = Client()
 
@@ -30,10 +123,15 @@ async def reload(interaction: discord.Interaction, cog:Literal["commands", "gen"
   try:
     await client.reload_extension(name="cogs."+cog.lower())
     await interaction.response.send_message(f"Se recargó **{cog}.py** exitosamente.", ephemeral=True)
+    # Si cambiaron los comandos del cog se vuelven a sincronizar
+    await client.sync_tree()
   except Exception as e:
-    print(e)
+    log.error("error al recargar el cog", cog=cog, error=e)
     await interaction.response.send_message(f"Error! no se pudo recargar el módulo. Revisa el error abajo \n```{e}```", ephemeral=True)
 
 
-client.run(config("TOKEN"))
+# El escaneo de la biblioteca usa procesos hijos; en Windows se vuelve a importar este módulo
+if __name__ == "__main__":
+    setup_logging()
+    client.run(config("TOKEN"), log_handler=None)
 
@@ -0,0 +1,284 @@
+import asyncio
+import threading
+import time
+from decouple import config
+from logs import get_logger
+
+log = get_logger(__name__)
+
+ENABLED = config("METRICS_ENABLED", default=False, cast=bool)
+PREFIX = "hiresqueen_"
+# Segundos: de 1 ms a 30 s, sirve tanto para búsquedas como para arranques de FFmpeg
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LOOP_LAG_INTERVAL = 0.5  # Cada cuánto se mide el retraso del event loop
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Timer:
+    # with HISTOGRAMA.time(): ... observa la duración del bloque
+    __slots__ = ("metric", "start")
+
+    def __init__(self, metric):
+        self.metric = metric
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metric.observe(time.perf_counter() - self.start)
+
+
+class NullMetric:
+    # Métrica desactivada: todas las operaciones son llamadas vacías
+    def labels(self, *values):
+        return self
+
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def time(self):
+        return NULL_TIMER
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_METRIC = NullMetric()
+NULL_TIMER = NullTimer()
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()  # Se observan métricas desde el hilo de audio
+
+    def labels(self, *values):
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.child())
+        return child
+
+    def child(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+    # Sin etiquetas la métrica se usa directamente
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return Timer(self.labels())
+
+
+class Value:
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, values):
+        return [f"{name}{format_labels(labelnames, values)} {self.value}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def child(self):
+        return Value()
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def child(self):
+        return Value()
+
+
+class HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        return Timer(self)
+
+    def render(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{format_labels(labelnames, values, [('le', bound)])} {cumulative}")
+        lines.append(f"{name}_bucket{format_labels(labelnames, values, [('le', '+Inf')])} {self.count}")
+        lines.append(f"{name}_sum{format_labels(labelnames, values)} {self.sum}")
+        lines.append(f"{name}_count{format_labels(labelnames, values)} {self.count}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def child(self):
+        return HistogramValue(self.buckets)
+
+
+class CallbackGauge:
+    # Gauge que se calcula al exportar (p. ej. longitud de las colas), sin coste en el camino caliente
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames, callback):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        try:
+            for values, value in self.callback():
+                lines.append(f"{self.name}{format_labels(self.labelnames, values)} {value}")
+        except Exception as e:
+            log.warning("error al calcular la métrica", metric=self.name, error=e)
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        # Volver a cargar un cog reemplaza sus métricas en lugar de duplicarlas
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames)) if ENABLED else NULL_METRIC
+
+
+def gauge(name, help, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, labelnames)) if ENABLED else NULL_METRIC
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets)) if ENABLED else NULL_METRIC
+
+
+def gauge_callback(name, help, labelnames, callback):
+    # `callback` devuelve [(valores de las etiquetas, valor)]
+    if ENABLED:
+        REGISTRY.register(CallbackGauge(name, help, labelnames, callback))
+
+
+LOOP_LAG = histogram("event_loop_lag_seconds", "Retraso del event loop respecto a lo programado",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+
+
+async def measure_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        LOOP_LAG.observe(max(0.0, loop.time() - start - LOOP_LAG_INTERVAL))
+
+
+async def handle_request(reader, writer):
+    # HTTP mínimo: solo GET /metrics, como lo pide Prometheus
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server():
+    # Devuelve las tareas/servidor a cerrar, o None si las métricas están desactivadas
+    if not ENABLED:
+        return None
+    host = config("METRICS_HOST", default="127.0.0.1")
+    port = config("METRICS_PORT", default=9108, cast=int)
+    server = await asyncio.start_server(handle_request, host, port)
+    asyncio.get_running_loop().create_task(measure_loop_lag())
+    log.info("métricas disponibles", url=f"http://{host}:{port}/metrics")
+    return server